@@ -1,32 +1,46 @@
 import asyncio
+import binascii
+import gzip
+import itertools
+import hashlib
 import logging
 import os
+import random
+import re
+import secrets
+import sys
+import time
 import uuid
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Optional, List
-import threading
+from typing import Awaitable, Callable, Dict, Optional, List
 import uvicorn
 import tempfile
 
-import aiofiles
+import aioboto3
+from aiolimiter import AsyncLimiter
+import brotli
+from cachetools import TTLCache
 from openai.types import ResponseFormatJSONObject
 from openai.types.chat import completion_create_params, ChatCompletionUserMessageParam
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, File
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from anthropic import AsyncAnthropic
-from openai import AsyncOpenAI
+from telegram.ext import AIORateLimiter, Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from openai import NOT_GIVEN, APIConnectionError, AsyncOpenAI
 from dotenv import load_dotenv
+import fastjsonschema
 import httpx
-import json
-from fastapi import FastAPI
+import orjson
+import redis.asyncio
+from fastapi import FastAPI, Request, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
-from html_generator import HTMLCarouselGenerator
 from json_html_generator import JSONCarouselGenerator
 from json_html_generator_style2 import JSONCarouselGeneratorStyle2
 from carousel_cache import CarouselCache
+from session_store import RedisSessionStore, Session
 
-# Load environment variables
+# Load environment variables (must run before the module-level configuration below reads them)
 load_dotenv()
 
 # Configure logging
@@ -36,12 +50,160 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Credentials read once at startup; frozen so they cannot be reassigned at runtime"""
+    telegram_token: Optional[str]
+    anthropic_key: Optional[str]
+    openai_key: Optional[str]
+    open_router_key: Optional[str]
+
 # Configuration
-TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-OPEN_ROUTER_API_KEY = os.getenv('OPEN_ROUTER_API_KEY')
+CFG = Config(
+    telegram_token=os.getenv('TELEGRAM_BOT_TOKEN'),
+    anthropic_key=os.getenv('ANTHROPIC_API_KEY'),
+    openai_key=os.getenv('OPENAI_API_KEY'),
+    open_router_key=os.getenv('OPEN_ROUTER_API_KEY'),
+)
 BASE_URL = os.getenv('BASE_URL', 'https://your-app.railway.app')
+REDIS_URL = os.getenv('REDIS_URL')
+
+# Development mode: prompt template edits are picked up without a restart
+DEBUG = os.getenv('DEBUG') == '1'
+
+# Receive updates via webhook instead of long polling when a public HTTPS base URL is configured.
+# Telegram posts to WEBHOOK_PATH on the app's own web server ($PORT) and proves itself with the secret;
+# set WEBHOOK_SECRET when several instances share one webhook, otherwise a per-process one is generated
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+# Object storage for published carousels (S3 or an S3-compatible store such as Cloudflare R2)
+S3_BUCKET = os.getenv('S3_BUCKET')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')
+CDN_BASE_URL = os.getenv('CDN_BASE_URL', f"https://{S3_BUCKET}.s3.amazonaws.com" if S3_BUCKET else None)
+
+# Abandoned sessions expire after this many seconds
+SESSION_TTL = 30 * 60
+
+# Seconds between sweeps for drafts whose sessions expired without publishing
+DRAFT_SWEEP_INTERVAL = 60 * 60
+
+# Minimum seconds between loading message edits while a response is streaming
+PROGRESS_INTERVAL = 1.5
+
+# AI models used for text generation
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+OPENAI_MODEL = "gpt-5"
+
+# Per-request limits for the AI providers: HTTP read timeout, SDK retries and an overall
+# deadline per provider attempt so a stalled call cannot hold a user's request indefinitely
+AI_TIMEOUT = float(os.getenv('AI_TIMEOUT', '60'))
+AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', '2'))
+AI_DEADLINE = float(os.getenv('AI_DEADLINE', '120'))
+
+# Seconds to wait on a running provider attempt before racing the next provider against it (text, images);
+# a text attempt that is already streaming tokens is never hedged, so this only bounds time to first token
+AI_HEDGE_DELAY = float(os.getenv('AI_HEDGE_DELAY', '20'))
+IMAGE_HEDGE_DELAY = float(os.getenv('IMAGE_HEDGE_DELAY', '30'))
+
+# Output token budgets per kind of text generation
+CONTENT_MAX_TOKENS = int(os.getenv('CONTENT_MAX_TOKENS', '2000'))
+SUGGESTIONS_MAX_TOKENS = int(os.getenv('SUGGESTIONS_MAX_TOKENS', '600'))
+CSS_MAX_TOKENS = int(os.getenv('CSS_MAX_TOKENS', '1000'))
+
+# At most this many text generations run at once across all users
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '8'))
+
+# OpenRouter image requests: at most this many in flight and this many started per second across all users
+OPENROUTER_MAX_CONCURRENCY = int(os.getenv('OPENROUTER_MAX_CONCURRENCY', '8'))
+OPENROUTER_MAX_RATE = float(os.getenv('OPENROUTER_MAX_RATE', '5'))
+
+# Exponential backoff between image request retries: first delay and ceiling in seconds (jittered by ±50%)
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_CAP = 20.0
+
+# Minimum seconds between text generation requests from the same user
+USER_REQUEST_INTERVAL = 3.0
+
+# Generated responses for identical prompts are reused for this many seconds
+GENERATION_CACHE_TTL = 7 * 24 * 3600
+
+# Image suggestions for identical carousel content are reused for this many seconds
+SUGGESTIONS_CACHE_TTL = 24 * 3600
+
+# Aggregate /stats results are reused for this many seconds
+STATS_CACHE_TTL = 60
+
+# Low-priority status replies are queued and sent in batches: flush window, per-chat batch size, queue bound
+OUTBOX_FLUSH_INTERVAL = 0.5
+OUTBOX_MAX_BATCH = 10
+OUTBOX_MAX_SIZE = 1024
+
+# Generated images waiting for the single writer worker; callers wait for a slot once this many are queued
+IMAGE_WRITE_QUEUE_SIZE = 256
+
+# Content generation prompt templates per carousel style
+CONTENT_PROMPT_PATHS = {
+    'style_1': Path("project/assets/content_creation_prompt.txt"),
+    'style_2': Path("project/assets/style_2_content_creation_prompt.txt"),
+}
+
+# All prompt templates cached in memory: content styles plus the image generation prompt
+PROMPT_PATHS = {
+    **CONTENT_PROMPT_PATHS,
+    'image': Path("project/assets/image_generation_prompt.txt"),
+}
+
+# Static instructions appended after the topic in every content generation prompt
+_PROMPT_SUFFIX = """
+Stwórz karuzelę na powyższy temat w formacie JSON zgodnie z podanym szablonem. 
+Pamiętaj o:
+- Użyciu formy "ty" 
+- Kontraście między przeszłością a teraźniejszością
+- Konkretnych, relatable przykładach
+- Empatycznym tonie
+- Polskim języku
+- Zwróceniu TYLKO poprawnego JSON-a bez dodatkowych komentarzy
+
+WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekstów, wyjaśnień ani formatowania markdown. Zwróć tylko czysty, poprawny JSON zgodny z szablonem.
+"""
+
+def _split_prompt(style: str, template: str) -> tuple[str, str]:
+    """Pre-split a prompt template into the constant text before and after its single user value"""
+    if style == 'image':
+        prefix, _, suffix = template.partition('{USER_INPUT}')
+        return prefix, suffix
+    
+    # Content prompts: style template, topic and the static instructions above
+    return f"\n{template}\n\nTEMAT KARUZELI: ", "\n" + _PROMPT_SUFFIX
+
+_MODIFY_TEMPLATE = """
+Oto oryginalna treść karuzeli na temat "{topic}":
+
+{original}
+
+Użytkownik poprosił o następujące modyfikacje:
+{mods}
+
+Zmodyfikuj treść karuzeli zgodnie z uwagami użytkownika, zachowując oryginalny format JSON i strukturę. 
+WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekstów, wyjaśnień ani formatowania markdown. Zwróć tylko czysty, poprawny JSON zgodny z oryginalnym szablonem.
+"""
+
+# Carousel appearance changes only ask the AI for CSS overrides instead of a whole new document
+_CSS_MODIFY_TEMPLATE = """
+Oto obecne style CSS karuzeli Instagram:
+
+{css}
+
+Użytkownik poprosił o następujące zmiany wyglądu:
+{mods}
+
+Zwróć TYLKO reguły CSS, które nadpiszą obecne style zgodnie z prośbą użytkownika. Nie powtarzaj niezmienionych reguł.
+WAŻNE: Odpowiedz TYLKO w formacie JSON: {{"css": "<reguły CSS>"}}. Nie dodawaj żadnych dodatkowych tekstów, wyjaśnień ani formatowania markdown.
+"""
+
+_STYLE_BLOCK_RE = re.compile(r"<style[^>]*>(.*?)</style>", re.DOTALL | re.IGNORECASE)
 
 # Initialize FastAPI app for serving static files
 web_app = FastAPI()
@@ -50,6 +212,10 @@ web_app = FastAPI()
 static_dir = Path("static")
 static_dir.mkdir(exist_ok=True)
 
+# Generated HTML awaiting approval (not publicly served)
+drafts_dir = Path("drafts")
+drafts_dir.mkdir(exist_ok=True)
+
 # Mount static files
 web_app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -66,38 +232,688 @@ async def root():
     </html>
     """)
 
-# Initialize AI clients
-anthropic_client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# Initialize AI clients (text generation goes through ModelPool; this client also serves Whisper and DALL-E)
+openai_client = AsyncOpenAI(
+    api_key=CFG.openai_key,
+    timeout=httpx.Timeout(AI_TIMEOUT, connect=5.0),
+    max_retries=AI_MAX_RETRIES
+) if CFG.openai_key else None
 
 # Initialize OpenRouter client for image generation
 openrouter_client = None
-if OPEN_ROUTER_API_KEY:
+if CFG.open_router_key:
     openrouter_client = httpx.AsyncClient(
         base_url="https://openrouter.ai/api/v1",
         headers={
-            "Authorization": f"Bearer {OPEN_ROUTER_API_KEY}",
+            "Authorization": f"Bearer {CFG.open_router_key}",
             "Content-Type": "application/json"
         },
-        timeout=httpx.Timeout(120.0, read=120.0, write=30.0, connect=10.0)  # Extended timeout for image generation
+        timeout=httpx.Timeout(120.0, read=120.0, write=30.0, connect=10.0),  # Extended timeout for image generation
+        # Concurrent image requests share multiplexed, kept-alive connections instead of new TLS handshakes
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60.0)
     )
 
-# User sessions storage (in production, use Redis or database)
-user_sessions: Dict[int, Dict] = {}
+# Shared client for downloading generated or user-supplied images
+download_client = httpx.AsyncClient(
+    timeout=30.0,
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0)
+)
+
+# Fixed part of the OpenRouter image request; each call only adds its messages
+_OPENROUTER_IMAGE_PAYLOAD = {
+    "model": "google/gemini-2.5-flash-image-preview",
+    "max_tokens": 1000,
+    "temperature": 0.7
+}
+
+@dataclass
+class _CircuitBreaker:
+    """Skips an AI provider after repeated failures until a recovery period has passed"""
+    name: str
+    threshold: int = 5
+    recovery: float = 60.0
+    state: str = "closed"  # closed, open or half_open
+    fail_count: int = 0
+    opened_at: float = 0.0
+    probe_started: float = 0.0
+    
+    def allow(self) -> bool:
+        """Return whether a call may be attempted; in half-open state only one probe runs at a time"""
+        if self.state == "closed":
+            return True
+        
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < self.recovery:
+                return False
+            self.state = "half_open"
+        elif now - self.probe_started < self.recovery:
+            # A probe is already in flight (a stale one is replaced after the recovery period)
+            return False
+        
+        self.probe_started = now
+        return True
+    
+    def record_success(self):
+        self.state = "closed"
+        self.fail_count = 0
+    
+    def record_failure(self):
+        self.fail_count += 1
+        if self.state == "half_open" or self.fail_count >= self.threshold:
+            if self.state != "open":
+                logger.warning("%s circuit opened after %s failures", self.name, self.fail_count)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+def _is_transient(error: Exception) -> bool:
+    """Return whether a provider error says the provider is unhealthy (timeout, connection, 429 or 5xx)"""
+    if isinstance(error, (TimeoutError, httpx.TransportError, APIConnectionError)):
+        return True
+    # anthropic is only imported when Claude keys are configured
+    anthropic = sys.modules.get("anthropic")
+    if anthropic is not None and isinstance(error, anthropic.APIConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+def _api_keys(name: str) -> List[str]:
+    """Collect NAME plus any numbered NAME_1, NAME_2, ... keys from the environment"""
+    keys = [os.getenv(name)]
+    index = 1
+    while os.getenv(f"{name}_{index}"):
+        keys.append(os.getenv(f"{name}_{index}"))
+        index += 1
+    return list(dict.fromkeys(key for key in keys if key))
+
+@dataclass
+class _PoolMember:
+    """One API client in the model pool"""
+    name: str
+    provider: str  # "claude" or "openai"
+    client: object
+    breaker: _CircuitBreaker
+
+class ModelPool:
+    """Text generation clients for every configured API key, each with its own circuit breaker"""
+    
+    def __init__(self):
+        self.members: Dict[str, List[_PoolMember]] = {"claude": [], "openai": []}
+        
+        anthropic_keys = _api_keys('ANTHROPIC_API_KEY')
+        if anthropic_keys:
+            # Imported here so the SDK is only loaded when Claude is configured
+            from anthropic import AsyncAnthropic
+            for index, key in enumerate(anthropic_keys, 1):
+                client = AsyncAnthropic(
+                    api_key=key,
+                    timeout=httpx.Timeout(AI_TIMEOUT, connect=5.0),
+                    max_retries=AI_MAX_RETRIES
+                )
+                self.members["claude"].append(_PoolMember(f"Claude #{index}", "claude", client, _CircuitBreaker(f"Claude #{index}")))
+        
+        for index, key in enumerate(_api_keys('OPENAI_API_KEY'), 1):
+            # Reuse the shared client for the primary key
+            client = openai_client if key == CFG.openai_key else AsyncOpenAI(
+                api_key=key,
+                timeout=httpx.Timeout(AI_TIMEOUT, connect=5.0),
+                max_retries=AI_MAX_RETRIES
+            )
+            self.members["openai"].append(_PoolMember(f"OpenAI #{index}", "openai", client, _CircuitBreaker(f"OpenAI #{index}")))
+        
+        self._rotation = {provider: itertools.count() for provider in self.members}
+    
+    def candidates(self):
+        """Yield members in try order: Claude keys round-robin first, then OpenAI keys round-robin"""
+        for provider in ("claude", "openai"):
+            members = self.members[provider]
+            if not members:
+                continue
+            
+            start = next(self._rotation[provider]) % len(members)
+            yield from members[start:] + members[:start]
+    
+    async def close(self):
+        """Close every pooled client"""
+        for members in self.members.values():
+            for member in members:
+                await member.client.close()
+
+def _truncate(text: str, limit: int) -> str:
+    """Shorten text to the given length, marking the cut with an ellipsis"""
+    return text[:limit] + "..." if len(text) > limit else text
+
+# Image URLs in Gemini text replies: markdown image syntax first, then any bare URL
+_MD_IMAGE_RE = re.compile(r'!\[.*?\]\((https?://[^\)]+)\)')
+_URL_RE = re.compile(r'https?://[^\s]+')
+
+# Zero-width split point after every blank line, i.e. between paragraphs of a preview
+_PARAGRAPH_BOUNDARY_RE = re.compile(r'(?<=\n\n)')
+
+# Telegram's legacy Markdown treats these as entity markers; a stray one makes the whole message fail to parse
+_MD_ESCAPE = str.maketrans({c: "\\" + c for c in "_*`["})
+_MD_SPECIAL_RE = re.compile(r'([_*`\[])')
+
+def _md_bold(text: str) -> str:
+    """Bold text for legacy Markdown, closing the entity around marker characters (escapes don't work inside it)"""
+    return "".join(
+        f"\\{part}" if index % 2 else f"*{part}*"
+        for index, part in enumerate(_MD_SPECIAL_RE.split(text)) if part
+    )
+
+def _looks_like_json(text: str) -> bool:
+    """Cheap structural check for a bare JSON object or array"""
+    return bool(text) and text[0] in '{[' and text[-1] in '}]'
+
+# Shape generated carousel content must have before it is cached, stored or shown
+_validate_cards = fastjsonschema.compile({
+    "type": "object",
+    "required": ["cards"],
+    "properties": {
+        "cards": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string"},
+                    "header": {"type": "string"},
+                    "text": {"type": "string"},
+                },
+            },
+        },
+    },
+})
+
+def _extract_json(text: str) -> Optional[str]:
+    """Return the JSON object in an AI reply, unwrapping surrounding prose or markdown fences"""
+    text = text.strip()
+    if _looks_like_json(text):
+        return text
+    
+    start, end = text.find('{'), text.rfind('}')
+    return text[start:end + 1] if start != -1 and end > start else None
+
+def _remove_stale_drafts(max_age: float):
+    """Delete drafts left behind by sessions that expired without publishing"""
+    cutoff = time.time() - max_age
+    for draft_path in drafts_dir.glob("carousel_*.html"):
+        if draft_path.stat().st_mtime < cutoff:
+            draft_path.unlink(missing_ok=True)
+
+def _write_base64_file(dir_fd: int, ext: str, data: str, start: int) -> str:
+    """Decode base64 text from the given offset into a content-addressed file in an open directory, returning its name"""
+    # Decode from a view of the ASCII payload: a single copy of the multi-MB string instead of slice + encode
+    image_bytes = binascii.a2b_base64(memoryview(data.encode('ascii'))[start:])
+    filename = f"img_{hashlib.blake2b(image_bytes, digest_size=16).hexdigest()}.{ext}"
+    
+    # An identical image was saved before; its URL can be reused as is
+    try:
+        os.stat(filename, dir_fd=dir_fd)
+        return filename
+    except FileNotFoundError:
+        pass
+    
+    # Write under a temporary name and rename, so the hash name only ever refers to a complete image
+    tmp_name = f".{filename}.{uuid.uuid4().hex}.tmp"
+    fd = os.open(tmp_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644, dir_fd=dir_fd)
+    try:
+        with open(fd, 'wb') as f:
+            f.write(image_bytes)
+        os.replace(tmp_name, filename, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+    except BaseException:
+        os.unlink(tmp_name, dir_fd=dir_fd)
+        raise
+    return filename
+
+def _write_published_html(draft_path: Path, file_path: Path, html_content: str):
+    """Move a draft into the served directory together with Brotli and gzip encoded copies"""
+    data = html_content.encode('utf-8')
+    draft_path.replace(file_path)
+    file_path.with_name(file_path.name + '.br').write_bytes(brotli.compress(data, quality=5))
+    file_path.with_name(file_path.name + '.gz').write_bytes(gzip.compress(data))
+
+# Static keyboards and texts are built once at import instead of on every callback
+_MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎨 Create New Carousel", callback_data="create_carousel")],
+    [InlineKeyboardButton("🖼️ Generate Image", callback_data="generate_image")],
+    [InlineKeyboardButton("📚 My History", callback_data="show_history")],
+    [InlineKeyboardButton("ℹ️ How It Works", callback_data="how_it_works")]
+])
+
+_RETURN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎨 Create New Carousel", callback_data="create_carousel")],
+    [InlineKeyboardButton("📚 My History", callback_data="show_history")],
+    [InlineKeyboardButton("ℹ️ How It Works", callback_data="how_it_works")]
+])
+
+_BACK_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]])
+
+_STYLE_SELECTION_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔸 Style 1 - Classic", callback_data="style_1")],
+    [InlineKeyboardButton("🔸 Style 2 - Grid", callback_data="style_2")],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
+])
+
+_CONTENT_REVIEW_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Approve Content", callback_data="approve_content")],
+    [InlineKeyboardButton("✏️ Request Modifications", callback_data="modify_content")],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
+])
+
+_MODIFIED_CONTENT_REVIEW_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Approve Content", callback_data="approve_content")],
+    [InlineKeyboardButton("✏️ Request More Changes", callback_data="modify_content")],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
+])
+
+_HTML_REVIEW_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Publish Carousel", callback_data="approve_html")],
+    [InlineKeyboardButton("✏️ Request Changes", callback_data="modify_html")],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
+])
+
+_MODIFIED_HTML_REVIEW_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Publish Carousel", callback_data="approve_html")],
+    [InlineKeyboardButton("✏️ More Changes", callback_data="modify_html")],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
+])
+
+_SKIP_DEFAULT_IMAGE_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏭️ Skip Image (Use Default)", callback_data="skip_image")],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
+])
+
+_SKIP_BACK_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏭️ Skip Image", callback_data="skip_image")],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
+])
+
+_IMAGE_APPROVAL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Use This Image", callback_data="approve_slide_image")],
+    [InlineKeyboardButton("🔄 Generate New Image", callback_data="decline_slide_image")],
+    [InlineKeyboardButton("🔗 Use Custom URL", callback_data="use_custom_url")],
+    [InlineKeyboardButton("⏭️ Skip Image", callback_data="skip_image")]
+])
+
+_HISTORY_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎨 Create New Carousel", callback_data="create_carousel")],
+    [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
+])
+
+# Rows shown under the per-carousel "Open Carousel" link button after publishing
+_PUBLISHED_ROWS = (
+    (InlineKeyboardButton("🎨 Create Another Carousel", callback_data="create_carousel"),),
+    (InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu"),),
+)
+
+_WELCOME_TEXT = (
+    "🎯 *Welcome to Instagram Carousel Generator!*\n\n"
+    "I'll help you create professional Instagram carousels and images:\n\n"
+    "1️⃣ Generate content using AI\n"
+    "2️⃣ Create beautiful HTML carousels\n"
+    "3️⃣ Generate custom images with DALL-E\n"
+    "4️⃣ Publish and get shareable links\n\n"
+    "Choose an option below to get started:"
+)
+
+_MENU_TEXT = (
+    "🎯 *Instagram Carousel Generator*\n\n"
+    "Choose an option:"
+)
+
+_NEW_CAROUSEL_TEXT = (
+    "🎨 *Choose Carousel Style*\n\n"
+    "Select the style for your carousel:\n\n"
+    "🔸 *Style 1 - Classic Cards*\n"
+    "Traditional carousel with navigation dots and buttons\n\n"
+    "🔸 *Style 2 - Grid Layout*\n"
+    "Modern grid layout with mountain illustration\n\n"
+    "Which style would you prefer?"
+)
+
+_MODIFY_REQUEST_TEXT = (
+    "✏️ *Content Modification*\n\n"
+    "Describe what changes you'd like to make to the carousel content:\n\n"
+    "• Change tone (more motivational, calmer, etc.)\n"
+    "• Add specific examples\n"
+    "• Change focus to another aspect of the topic\n"
+    "• Other suggestions...\n\n"
+    "*Write your feedback:*"
+)
+
+_HTML_MODIFY_REQUEST_TEXT = (
+    "🎨 *Appearance Modification*\n\n"
+    "Describe what changes you'd like to make to the carousel appearance:\n\n"
+    "• Change colors (background, text, buttons)\n"
+    "• Adjust font sizes\n"
+    "• Change element layout\n"
+    "• Other stylistic suggestions...\n\n"
+    "*Write your feedback:*"
+)
+
+_STATS_TEMPLATE = (
+    "📊 *Carousel Generator Statistics:*\n\n"
+    "🎨 Total Carousels: {total_carousels}\n"
+    "👥 Unique Users: {unique_users}\n"
+    "🔥 Created Today: {recent_carousels}\n\n"
+)
+_STATS_DEFAULTS = {'total_carousels': 0, 'unique_users': 0, 'recent_carousels': 0}
+_POPULAR_TOPICS_HEADER = "*Popular Topics:*\n"
+_STATS_MAX_TOPICS = 10
+_STATS_MAX_LENGTH = 3500  # Stay well under Telegram's 4096 character message limit
+
+_RATE_LIMITED_TEXT = "⏳ Please wait a few seconds before sending another request."
+
+_HOW_IT_WORKS_TEXT = (
+    "ℹ️ *How does the carousel generator work?*\n\n"
+    "*Step 1: Content Generation* 🤖\n"
+    "• You provide the carousel topic\n"
+    "• AI creates professional content in 7-card format\n"
+    "• You can approve or request modifications\n\n"
+    "*Step 2: HTML Creation* 🎨\n"
+    "• Content is placed in a beautiful template\n"
+    "• You get a carousel preview\n"
+    "• You can approve or request changes\n\n"
+    "*Step 3: Publishing* 🌐\n"
+    "• I publish the carousel online\n"
+    "• You get a shareable link\n"
+    "• You can immediately share with your followers!\n\n"
+    "The whole process takes 2-3 minutes! 🚀"
+)
 
 class CarouselBot:
     def __init__(self):
-        self.app = Application.builder().token(TELEGRAM_TOKEN).build()
-        self.html_generator = HTMLCarouselGenerator()
+        # Outgoing messages queue client-side under Telegram's flood limits instead of failing with 429s
+        rate_limiter = AIORateLimiter(overall_max_rate=30, overall_time_period=1, group_max_rate=20, group_time_period=60)
+        self.app = Application.builder().token(CFG.telegram_token).rate_limiter(rate_limiter).post_init(self.on_startup).build()
         self.json_generator = JSONCarouselGenerator()
         self.json_generator_style2 = JSONCarouselGeneratorStyle2()
         self.cache = CarouselCache()
+        self.redis = redis.asyncio.from_url(REDIS_URL) if REDIS_URL else None
+        self.sessions = RedisSessionStore(self.redis, ttl=SESSION_TTL)
+        self.s3_session = aioboto3.Session() if S3_BUCKET else None
+        self.s3 = None  # S3 client opened in on_startup and kept for every publish
+        self._s3_stack = AsyncExitStack()
+        self._stats_query: Optional[asyncio.Task] = None  # stats query in flight, shared by concurrent callers
+        self._stats_text: Optional[tuple[float, str]] = None  # (expires at, rendered /stats reply)
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=OUTBOX_MAX_SIZE)
+        self._outbox_task: Optional[asyncio.Task] = None
+        self._image_queue: asyncio.Queue = asyncio.Queue(maxsize=IMAGE_WRITE_QUEUE_SIZE)
+        self._image_writer_task: Optional[asyncio.Task] = None
+        self._draft_sweep_task: Optional[asyncio.Task] = None
+        self._background_tasks: set[asyncio.Task] = set()  # fire-and-forget calls, referenced until done
+        self.model_pool = ModelPool()
+        self._ai_sem = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+        self._openrouter_sem = asyncio.Semaphore(OPENROUTER_MAX_CONCURRENCY)
+        self._openrouter_limiter = AsyncLimiter(OPENROUTER_MAX_RATE, 1.0)
+        self._openrouter_resume_at = 0.0  # monotonic time before which a 429 asked us not to send
+        # Entries expire after the throttle interval, so users who stop sending requests drop out on their own
+        self._user_last_request: TTLCache = TTLCache(maxsize=100_000, ttl=USER_REQUEST_INTERVAL)
+        # In-process front for cached image suggestions; the only cache when Redis is not configured
+        self._suggestions_cache: TTLCache = TTLCache(maxsize=512, ttl=SUGGESTIONS_CACHE_TTL)
+        
+        # Prompt templates are static, so read and pre-split them once instead of on every request
+        self.prompt_templates = {
+            style: _split_prompt(style, path.read_text(encoding='utf-8'))
+            for style, path in PROMPT_PATHS.items()
+        }
+        self._prompt_mtimes = {
+            style: path.stat().st_mtime
+            for style, path in PROMPT_PATHS.items()
+        }
+        
+        # Inline keyboard callback data -> handler taking (query, user_id)
+        self._callback_handlers = {
+            "create_carousel": self.start_carousel_creation,
+            "generate_image": self.start_image_generation,
+            "how_it_works": lambda query, user_id: self.show_how_it_works(query),
+            "approve_content": self.approve_content,
+            "modify_content": self.request_modifications,
+            "approve_html": self.publish_carousel,
+            "modify_html": self.request_html_modifications,
+            "back_to_menu": self.back_to_main_menu,
+            "show_history": self.show_user_history,
+            "style_1": lambda query, user_id: self.select_style(query, user_id, "style_1"),
+            "style_2": lambda query, user_id: self.select_style(query, user_id, "style_2"),
+            "skip_image": self.skip_image_generation,
+            "approve_slide_image": self.approve_slide_image,
+            "decline_slide_image": self.decline_slide_image,
+            "use_custom_url": self.request_image_url,
+        }
         self.setup_handlers()
     
-    async def generate_with_ai(self, prompt: str) -> str:
-        """Generate content using AI with fallback mechanism"""
-        # Try Claude first
-        import json
+    async def on_startup(self, application: Application):
+        """Prepare shared resources once before the bot starts handling updates"""
+        await self.cache.init_db()
+        self._draft_sweep_task = asyncio.create_task(self._draft_sweeper())
+        self._outbox_task = asyncio.create_task(self._outbox_worker())
+        self._image_writer_task = asyncio.create_task(self._image_writer())
+        if self.s3_session:
+            # One client for the bot's lifetime so publishes reuse its connection pool
+            self.s3 = await self._s3_stack.enter_async_context(self.s3_session.client("s3", endpoint_url=S3_ENDPOINT_URL))
+    
+    async def start_updates(self):
+        """Start receiving updates, by webhook when WEBHOOK_URL is set and by long polling otherwise"""
+        if WEBHOOK_URL:
+            # Telegram only calls in when there is an update, so an idle bot does no work;
+            # updates arrive through handle_webhook on the existing web server
+            await self.app.bot.set_webhook(url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+        else:
+            await self.app.updater.start_polling()
+    
+    async def stop_updates(self):
+        """Stop long polling if it was started (webhook updates simply stop arriving)"""
+        if self.app.updater.running:
+            await self.app.updater.stop()
+    
+    async def handle_webhook(self, request: Request) -> Response:
+        """Queue an update posted by Telegram to WEBHOOK_PATH"""
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token, WEBHOOK_SECRET):
+            return Response(status_code=403)
+        
+        update = Update.de_json(orjson.loads(await request.body()), self.app.bot)
+        await self.app.update_queue.put(update)
+        return Response()
+    
+    def _queue_status(self, chat_id: int, text: str):
+        """Queue a non-interactive status message for the outbox worker"""
+        try:
+            self._outbox.put_nowait((chat_id, text))
+        except asyncio.QueueFull:
+            logger.warning("Outbox full, dropping status message for chat %s", chat_id)
+    
+    async def _outbox_worker(self):
+        """Send queued status messages, merging messages to the same chat within one flush window"""
+        while True:
+            chat_id, text = await self._outbox.get()
+            pending: Dict[int, List[str]] = {chat_id: [text]}
+            deadline = time.monotonic() + OUTBOX_FLUSH_INTERVAL
+            
+            while len(pending[chat_id]) < OUTBOX_MAX_BATCH:
+                try:
+                    chat_id, text = await asyncio.wait_for(self._outbox.get(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+                pending.setdefault(chat_id, []).append(text)
+            
+            for chat_id, texts in pending.items():
+                try:
+                    await self.app.bot.send_message(chat_id, "\n".join(texts))
+                except Exception as e:
+                    logger.warning("Could not send queued status message to chat %s: %s", chat_id, e)
+    
+    def _delete_in_background(self, message):
+        """Delete a message without waiting for Telegram to confirm it"""
+        def done(task: asyncio.Task):
+            self._background_tasks.discard(task)
+            if not task.cancelled() and task.exception():
+                logger.warning("Could not delete message: %s", task.exception())
+        
+        task = asyncio.create_task(message.delete())
+        self._background_tasks.add(task)
+        task.add_done_callback(done)
+    
+    async def _image_writer(self):
+        """Write queued generated images into the static directory through one open directory descriptor"""
+        # static_dir is created at import, so it is opened once here instead of resolved and mkdir'ed per image
+        dir_fd = os.open(static_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            while True:
+                ext, data, start, written = await self._image_queue.get()
+                # The requester may have given up, e.g. when DALL-E won the image race
+                if written.done():
+                    continue
+                
+                try:
+                    filename = await asyncio.to_thread(_write_base64_file, dir_fd, ext, data, start)
+                except Exception as e:
+                    if not written.done():
+                        written.set_exception(e)
+                else:
+                    if not written.done():
+                        written.set_result(filename)
+        finally:
+            os.close(dir_fd)
+    
+    async def _draft_sweeper(self):
+        """Periodically delete drafts left behind by sessions that expired without publishing"""
+        while True:
+            try:
+                await asyncio.to_thread(_remove_stale_drafts, SESSION_TTL)
+            except OSError as e:
+                logger.warning("Could not sweep stale drafts: %s", e)
+            await asyncio.sleep(DRAFT_SWEEP_INTERVAL)
+    
+    async def _replace_session(self, user_id: int, session: Session):
+        """Start the user over with a new session, discarding the old session's unpublished draft"""
+        old = await self.sessions.get(user_id)
+        if old is not None and old.draft_file_path is not None:
+            await asyncio.to_thread(Path(old.draft_file_path).unlink, missing_ok=True)
+        await self.sessions.set(user_id, session)
+    
+    async def _save_draft(self, session: Session, html_content: str):
+        """Write generated HTML to the session's draft file, creating the draft on first use"""
+        if session.draft_file_path is None:
+            session.carousel_id = uuid.uuid4().hex
+            session.draft_file_path = str(drafts_dir / f"carousel_{session.carousel_id}.html")
+        
+        await asyncio.to_thread(Path(session.draft_file_path).write_text, html_content, encoding='utf-8')
+    
+    async def _load_draft(self, session: Session) -> str:
+        """Read the session's draft HTML"""
+        return await asyncio.to_thread(Path(session.draft_file_path).read_text, encoding='utf-8')
+    
+    def _get_prompt_template(self, style: str) -> tuple[str, str]:
+        """Return the cached (prefix, suffix) prompt for a style, re-reading it after edits in DEBUG mode"""
+        if style not in self.prompt_templates:
+            style = 'style_1'
+        
+        if DEBUG:
+            path = PROMPT_PATHS[style]
+            mtime = path.stat().st_mtime
+            if mtime != self._prompt_mtimes[style]:
+                logger.info("Reloading prompt template %s", path)
+                self.prompt_templates[style] = _split_prompt(style, path.read_text(encoding='utf-8'))
+                self._prompt_mtimes[style] = mtime
+        
+        return self.prompt_templates[style]
+    
+    def _generation_cache_key(self, prompt: str) -> str:
+        """Build the Redis key for a prompt and the models that would answer it"""
+        digest = hashlib.blake2b(f"{CLAUDE_MODEL}\n{OPENAI_MODEL}\n{prompt}".encode('utf-8'), digest_size=16)
+        return f"llm:{digest.hexdigest()}"
+    
+    async def _get_cached_generation(self, prompt: str) -> Optional[str]:
+        """Return a previously generated response for an identical prompt, if cached"""
+        if self.redis is None:
+            return None
+        
+        try:
+            cached = await self.redis.get(self._generation_cache_key(prompt))
+        except Exception as e:
+            logger.warning("Generation cache lookup failed: %s", e)
+            return None
+        
+        if cached:
+            logger.info("Using cached AI response")
+            return cached.decode('utf-8')
+        return None
+    
+    async def _cache_generation(self, prompt: str, content: str, ttl: int = GENERATION_CACHE_TTL):
+        """Remember a validated response so identical prompts skip the AI call"""
+        if self.redis is None:
+            return
+        
+        try:
+            await self.redis.set(self._generation_cache_key(prompt), content, ex=ttl)
+        except Exception as e:
+            logger.warning("Generation cache store failed: %s", e)
+    
+    def _fetch_stats(self) -> asyncio.Task:
+        """Share the running stats query with every caller that arrives before it finishes"""
+        # Only in-flight queries are shared; caching results is left to the Redis and rendered-reply layers
+        if self._stats_query is None or self._stats_query.done():
+            self._stats_query = asyncio.create_task(self.cache.get_carousel_stats())
+        return self._stats_query
+    
+    async def _get_carousel_stats(self) -> tuple[dict, float]:
+        """Return carousel statistics and when they were queried, reusing a recent result instead of rescanning the table"""
+        if self.redis is not None:
+            try:
+                cached = await self.redis.get("stats:carousels")
+                if cached:
+                    entry = orjson.loads(cached)
+                    if "stats" in entry:
+                        return entry["stats"], entry["fetched_at"]
+            except Exception as e:
+                logger.warning("Stats cache lookup failed: %s", e)
+        
+        # Shielded so a cancelled handler does not cancel the query other callers are waiting on
+        fetched_at = time.time()
+        stats = await asyncio.shield(self._fetch_stats())
+        if not stats:
+            return stats, fetched_at
+        
+        if self.redis is not None:
+            try:
+                entry = {"stats": stats, "fetched_at": fetched_at}
+                await self.redis.set("stats:carousels", orjson.dumps(entry), ex=STATS_CACHE_TTL)
+            except Exception as e:
+                logger.warning("Stats cache store failed: %s", e)
+        return stats, fetched_at
+    
+    def _progress_reporter(self, message, text: str) -> Callable[[int], Awaitable[None]]:
+        """Build a callback that edits a loading message with the streamed character count"""
+        async def report(received: int):
+            try:
+                await message.edit_text(f"{text} ({received} characters received)")
+            except Exception as e:
+                logger.debug("Could not update progress message: %s", e)
+        
+        return report
+    
+    def _allow_user_request(self, user_id: int) -> bool:
+        """Return whether the user may start another generation, recording the attempt if so"""
+        now = time.monotonic()
+        if now - self._user_last_request.get(user_id, float('-inf')) < USER_REQUEST_INTERVAL:
+            return False
+        
+        self._user_last_request[user_id] = now
+        return True
+    
+    async def generate_with_ai(self, prompt: str, on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+                               max_tokens: int = CONTENT_MAX_TOKENS, json_mode: bool = True) -> str:
+        """Generate content using AI, bounded by the global concurrency limit; json_mode asks OpenAI for a JSON object"""
+        async with self._ai_sem:
+            return await self._generate_with_fallback(prompt, on_progress, max_tokens, json_mode)
+    
+    async def _generate_with_fallback(self, prompt: str, on_progress: Optional[Callable[[int], Awaitable[None]]],
+                                      max_tokens: int, json_mode: bool = True) -> str:
+        """Generate content using AI, falling back across pooled clients and hedging slow attempts"""
+        # Try Claude keys first
 #         return  json.dumps({
 #   "cards": [
 #     {
@@ -147,84 +963,197 @@ class CarouselBot:
 #     }
 #   ]
 # })
-        if anthropic_client:
-            try:
-                logger.info("Attempting to generate content with Claude...")
-                response = await anthropic_client.messages.create(
-                    model="claude-3-5-sonnet-20241022",
-                    max_tokens=2000,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                logger.info("Claude generation successful")
-                return response.content[0].text
-            except Exception as e:
-                logger.warning(f"Claude failed: {e}. Falling back to OpenAI...")
-        
-        # Fallback to OpenAI GPT-5
-        if openai_client:
-            try:
-                logger.info("Attempting to generate content with OpenAI GPT-5...")
-                response = await openai_client.chat.completions.create(
-                    model="gpt-5",
-                    max_completion_tokens=8000,  # Increased from 4000 to 8000
-                    messages=[ChatCompletionUserMessageParam(role="user", content=prompt)],
-                    response_format=completion_create_params.ResponseFormatJSONObject(type="json_object"),
-                )
-                # Check if response was truncated
-                choice = response.choices[0]
-                content = choice.message.content
+        pool_members = list(self.model_pool.candidates())
+        if not pool_members:
+            # No API keys available
+            raise Exception("No AI API keys configured. Please contact the administrator.")
+        
+        remaining = iter(pool_members)
+        attempts: Dict[asyncio.Task, _PoolMember] = {}
+        streaming: set = set()  # names of members whose attempt has started returning tokens
+        
+        def launch(progress: Optional[Callable[[int], Awaitable[None]]]) -> bool:
+            """Start the next member whose circuit allows a call"""
+            for member in remaining:
+                if not member.breaker.allow():
+                    logger.info("%s circuit is open, skipping", member.name)
+                    continue
                 
-                if not content or content.strip() == '':
-                    logger.error("OpenAI returned empty content")
-                    raise Exception("AI returned empty response. Please try again.")
+                async def track(received: int, name=member.name):
+                    # Progress is reported once tokens flow, which marks the attempt as alive
+                    streaming.add(name)
+                    if progress:
+                        await progress(received)
+                
+                logger.info("Attempting to generate content with %s...", member.name)
+                attempts[asyncio.create_task(self._generate_with_member(member, prompt, track, max_tokens, json_mode))] = member
+                return True
+            return False
+        
+        launch(on_progress)
+        try:
+            while attempts:
+                done, _ = await asyncio.wait(attempts, timeout=AI_HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # A long generation that is still streaming is healthy; AI_DEADLINE bounds it
+                    if any(member.name in streaming for member in attempts.values()):
+                        continue
+                    # No tokens yet: race the next provider against the slow attempt (only the first reports progress)
+                    if launch(None):
+                        logger.info("No response after %ss, hedging with another provider", AI_HEDGE_DELAY)
+                    continue
                 
-                if choice.finish_reason == 'length':
-                    logger.warning("OpenAI response was truncated due to length limit")
-                    # Try to use truncated content if it's valid JSON
+                for task in done:
+                    member = attempts.pop(task)
                     try:
-                        import json
-                        # Attempt to parse as JSON to see if it's still valid
-                        json.loads(content)
-                        logger.info("Truncated response is still valid JSON, using it")
+                        content = task.result()
+                    except Exception as e:
+                        logger.warning("%s failed: %s", member.name, e)
+                        if _is_transient(e):
+                            member.breaker.record_failure()
+                        else:
+                            # A rejected request (e.g. a 400) still proves the provider is up
+                            member.breaker.record_success()
+                    else:
+                        member.breaker.record_success()
                         return content
-                    except json.JSONDecodeError:
-                        # If truncated content is invalid JSON, try to fix it
-                        logger.warning("Truncated response is invalid JSON, attempting to fix...")
-                        try:
-                            # Try to close incomplete JSON structures
-                            fixed_content = self.fix_truncated_json(content)
-                            json.loads(fixed_content)  # Validate the fix
-                            logger.info("Successfully fixed truncated JSON")
-                            return fixed_content
-                        except:
-                            logger.error("Could not fix truncated JSON")
-                            # As a last resort, try with a shorter prompt
-                            logger.info("Attempting generation with shorter prompt...")
-                            try:
-                                shorter_prompt = self.create_shorter_prompt(prompt)
-                                shorter_response = await openai_client.chat.completions.create(
-                                    model="gpt-5",
-                                    max_completion_tokens=6000,  # Slightly reduced for shorter content
-                                    messages=[ChatCompletionUserMessageParam(role="user", content=shorter_prompt)],
-                                    response_format=completion_create_params.ResponseFormatJSONObject(type="json_object"),
-                                )
-                                shorter_content = shorter_response.choices[0].message.content
-                                if shorter_content and shorter_content.strip():
-                                    logger.info("Shorter prompt generation successful")
-                                    return shorter_content
-                            except Exception as shorter_error:
-                                logger.error(f"Shorter prompt also failed: {shorter_error}")
-                            
-                            raise Exception("Response was truncated and could not be repaired. Please try again or contact administrator.")
                 
-                logger.info("OpenAI generation successful")
+                # Fall back to the next provider unless a hedged attempt is still running
+                if not attempts:
+                    launch(on_progress)
+        finally:
+            # Whichever attempts lost the race are cancelled without counting against their circuits
+            for task in attempts:
+                task.cancel()
+        
+        raise Exception("Both Claude and OpenAI are unavailable. Please try again later.")
+    
+    async def _generate_with_member(self, member: _PoolMember, prompt: str,
+                                    on_progress: Optional[Callable[[int], Awaitable[None]]], max_tokens: int,
+                                    json_mode: bool = True) -> str:
+        """Generate content with one pooled client"""
+        if member.provider == "claude":
+            return await self._generate_with_claude(member.client, prompt, on_progress, max_tokens)
+        return await self._generate_with_openai(member.client, prompt, on_progress, json_mode)
+    
+    async def _generate_with_claude(self, client, prompt: str, on_progress: Optional[Callable[[int], Awaitable[None]]],
+                                    max_tokens: int) -> str:
+        """Generate content with one Anthropic client, streaming progress to the caller"""
+        parts = []
+        received = 0
+        last_progress = time.monotonic()
+        
+        # Stream the response so the user sees progress instead of a static message
+        async with asyncio.timeout(AI_DEADLINE):
+            async with client.messages.stream(
+                model=CLAUDE_MODEL,
+                max_tokens=max_tokens,
+                messages=[{"role": "user", "content": prompt}]
+            ) as stream:
+                async for text in stream.text_stream:
+                    parts.append(text)
+                    received += len(text)
+                    
+                    if on_progress and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = time.monotonic()
+                        await on_progress(received)
+                
+                usage = (await stream.get_final_message()).usage
+        
+        logger.info("Claude generation successful (input tokens: %s, output tokens: %s)", usage.input_tokens, usage.output_tokens)
+        return "".join(parts)
+    
+    async def _generate_with_openai(self, client, prompt: str,
+                                    on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+                                    json_mode: bool = True) -> str:
+        """Generate content with one OpenAI client; in JSON mode, repair truncated responses where possible"""
+        parts = []
+        received = 0
+        last_progress = time.monotonic()
+        finish_reason = None
+        usage = None
+        
+        # Stream the response so the user sees progress instead of a static message
+        async with asyncio.timeout(AI_DEADLINE):
+            stream = await client.chat.completions.create(
+                model=OPENAI_MODEL,
+                max_completion_tokens=8000,  # Includes GPT-5 reasoning tokens, so kept well above max_tokens
+                messages=[ChatCompletionUserMessageParam(role="user", content=prompt)],
+                # JSON mode rejects prompts that don't mention JSON, so plain-text requests go without it
+                response_format=completion_create_params.ResponseFormatJSONObject(type="json_object") if json_mode else NOT_GIVEN,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async for chunk in stream:
+                # The final chunk carries only usage and has no choices
+                if chunk.usage:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    received += len(choice.delta.content)
+                    
+                    if on_progress and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = time.monotonic()
+                        await on_progress(received)
+        
+        if usage:
+            logger.info("OpenAI usage (input tokens: %s, output tokens: %s)", usage.prompt_tokens, usage.completion_tokens)
+        content = "".join(parts)
+        
+        if not content or content.strip() == '':
+            logger.error("OpenAI returned empty content")
+            raise Exception("AI returned empty response. Please try again.")
+        
+        # Check if response was truncated
+        if finish_reason == 'length':
+            logger.warning("OpenAI response was truncated due to length limit")
+            if not json_mode:
                 return content
-            except Exception as e:
-                logger.error(f"OpenAI also failed: {e}")
-                raise Exception("Both Claude and OpenAI are unavailable. Please try again later.")
+            # Try to use truncated content if it's valid JSON
+            try:
+                # Attempt to parse as JSON to see if it's still valid
+                orjson.loads(content)
+                logger.info("Truncated response is still valid JSON, using it")
+                return content
+            except orjson.JSONDecodeError:
+                # If truncated content is invalid JSON, try to fix it
+                logger.warning("Truncated response is invalid JSON, attempting to fix...")
+                try:
+                    # Try to close incomplete JSON structures
+                    fixed_content = self.fix_truncated_json(content)
+                    orjson.loads(fixed_content)  # Validate the fix
+                    logger.info("Successfully fixed truncated JSON")
+                    return fixed_content
+                except:
+                    logger.error("Could not fix truncated JSON")
+                    # As a last resort, try with a shorter prompt
+                    logger.info("Attempting generation with shorter prompt...")
+                    try:
+                        shorter_prompt = self.create_shorter_prompt(prompt)
+                        async with asyncio.timeout(AI_DEADLINE):
+                            shorter_response = await client.chat.completions.create(
+                                model=OPENAI_MODEL,
+                                max_completion_tokens=6000,  # Slightly reduced for shorter content
+                                messages=[ChatCompletionUserMessageParam(role="user", content=shorter_prompt)],
+                                response_format=completion_create_params.ResponseFormatJSONObject(type="json_object"),
+                            )
+                        shorter_content = shorter_response.choices[0].message.content
+                        if shorter_content and shorter_content.strip():
+                            logger.info("Shorter prompt generation successful")
+                            return shorter_content
+                    except Exception as shorter_error:
+                        logger.error("Shorter prompt also failed: %s", shorter_error)
+                    
+                    raise Exception("Response was truncated and could not be repaired. Please try again or contact administrator.")
         
-        # No API keys available
-        raise Exception("No AI API keys configured. Please contact the administrator.")
+        logger.info("OpenAI generation successful")
+        return content
     
     def fix_truncated_json(self, truncated_json: str) -> str:
         """Attempt to fix truncated JSON by closing incomplete structures"""
@@ -232,39 +1161,46 @@ class CarouselBot:
             # Remove any trailing incomplete text
             content = truncated_json.strip()
             
-            # Count open and close braces/brackets
-            open_braces = content.count('{')
-            close_braces = content.count('}')
-            open_brackets = content.count('[')
-            close_brackets = content.count(']')
-            
-            # Add missing closing braces
-            missing_braces = open_braces - close_braces
-            missing_brackets = open_brackets - close_brackets
-            
-            # If we're in the middle of a string, try to close it
-            quote_count = content.count('"')
-            if quote_count % 2 == 1:  # Odd number of quotes means unclosed string
+            # Single pass tracking string state (honouring escapes) and the closers still owed, innermost last
+            closers = []
+            in_string = False
+            escaped = False
+            for ch in content:
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif ch == '\\':
+                        escaped = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"':
+                    in_string = True
+                elif ch == '{':
+                    closers.append('}')
+                elif ch == '[':
+                    closers.append(']')
+                elif ch in '}]' and closers:
+                    closers.pop()
+            
+            # If we're in the middle of a string, try to close it (dropping a dangling escape first)
+            if in_string:
+                if escaped:
+                    content = content[:-1]
                 content += '"'
             
-            # Add missing closing brackets and braces
-            content += ']' * missing_brackets
-            content += '}' * missing_braces
-            
-            return content
+            # Close the open arrays and objects in nesting order
+            return content + ''.join(reversed(closers))
         except Exception as e:
-            logger.error(f"Error fixing truncated JSON: {e}")
+            logger.error("Error fixing truncated JSON: %s", e)
             raise
     
     def create_shorter_prompt(self, original_prompt: str) -> str:
         """Create a shorter version of the prompt to avoid truncation"""
         # Check if this is a content generation prompt (contains examples and detailed instructions)
         if "CARD COUNT FLEXIBILITY" in original_prompt or "cards can vary from" in original_prompt:
-            # Extract topic from original prompt
-            if 'Topic:' in original_prompt:
-                topic_part = original_prompt.split('Topic:')[-1].split('\n')[0]
-            else:
-                topic_part = 'Personal development'
+            # Extract topic from original prompt (the text after the last 'Topic:', up to the end of that line)
+            _, sep, rest = original_prompt.rpartition('Topic:')
+            topic_part = rest.partition('\n')[0] if sep else 'Personal development'
             
             # This is a content generation prompt, create a shorter version
             shorter_prompt = f"""
@@ -318,30 +1254,9 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         user_id = update.effective_user.id
-        user_sessions[user_id] = {'state': 'main_menu'}
-        
-        # Initialize database on first use
-        await self.cache.init_db()
+        await self._replace_session(user_id, Session(state='main_menu'))
         
-        keyboard = [
-            [InlineKeyboardButton("🎨 Create New Carousel", callback_data="create_carousel")],
-            [InlineKeyboardButton("🖼️ Generate Image", callback_data="generate_image")],
-            [InlineKeyboardButton("📚 My History", callback_data="show_history")],
-            [InlineKeyboardButton("ℹ️ How It Works", callback_data="how_it_works")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        welcome_text = (
-            "🎯 *Welcome to Instagram Carousel Generator!*\n\n"
-            "I'll help you create professional Instagram carousels and images:\n\n"
-            "1️⃣ Generate content using AI\n"
-            "2️⃣ Create beautiful HTML carousels\n"
-            "3️⃣ Generate custom images with DALL-E\n"
-            "4️⃣ Publish and get shareable links\n\n"
-            "Choose an option below to get started:"
-        )
-        
-        await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+        await update.message.reply_text(_WELCOME_TEXT, reply_markup=_MAIN_MENU_MARKUP, parse_mode='Markdown')
         
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle inline keyboard callbacks"""
@@ -349,72 +1264,20 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
         await query.answer()
         
         user_id = query.from_user.id
-        data = query.data
-        
-        if data == "create_carousel":
-            await self.start_carousel_creation(query, user_id)
-        elif data == "generate_image":
-            await self.start_image_generation(query, user_id)
-        elif data == "how_it_works":
-            await self.show_how_it_works(query)
-        elif data == "approve_content":
-            await self.approve_content(query, user_id)
-        elif data == "modify_content":
-            await self.request_modifications(query, user_id)
-        elif data == "approve_html":
-            await self.publish_carousel(query, user_id)
-        elif data == "modify_html":
-            await self.request_html_modifications(query, user_id)
-        elif data == "back_to_menu":
-            await self.back_to_main_menu(query, user_id)
-        elif data == "show_history":
-            await self.show_user_history(query, user_id)
-        elif data == "style_1":
-            await self.select_style(query, user_id, "style_1")
-        elif data == "style_2":
-            await self.select_style(query, user_id, "style_2")
-        elif data == "skip_image":
-            await self.skip_image_generation(query, user_id)
-        elif data == "approve_slide_image":
-            await self.approve_slide_image(query, user_id)
-        elif data == "decline_slide_image":
-            await self.decline_slide_image(query, user_id)
-        elif data == "use_custom_url":
-            await self.request_image_url(query, user_id)
+        
+        handler = self._callback_handlers.get(query.data)
+        if handler:
+            await handler(query, user_id)
             
     async def start_carousel_creation(self, query, user_id: int):
         """Start the carousel creation process"""
-        user_sessions[user_id] = {
-            'state': 'awaiting_style_selection',
-            'step': 'style_selection'
-        }
+        await self._replace_session(user_id, Session(state='awaiting_style_selection', step='style_selection'))
         
-        text = (
-            "🎨 *Choose Carousel Style*\n\n"
-            "Select the style for your carousel:\n\n"
-            "🔸 *Style 1 - Classic Cards*\n"
-            "Traditional carousel with navigation dots and buttons\n\n"
-            "🔸 *Style 2 - Grid Layout*\n"
-            "Modern grid layout with mountain illustration\n\n"
-            "Which style would you prefer?"
-        )
-        
-        keyboard = [
-            [InlineKeyboardButton("🔸 Style 1 - Classic", callback_data="style_1")],
-            [InlineKeyboardButton("🔸 Style 2 - Grid", callback_data="style_2")],
-            [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text(_NEW_CAROUSEL_TEXT, reply_markup=_STYLE_SELECTION_MARKUP, parse_mode='Markdown')
     
     async def select_style(self, query, user_id: int, style: str):
         """Handle style selection and proceed to topic input"""
-        user_sessions[user_id] = {
-            'state': 'awaiting_topic',
-            'step': 'content_generation',
-            'style': style
-        }
+        await self._replace_session(user_id, Session(state='awaiting_topic', step='content_generation', style=style))
         
         style_name = "Classic Cards" if style == "style_1" else "Grid Layout"
         
@@ -428,16 +1291,11 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
             "*Write your topic:*"
         )
         
-        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text(text, reply_markup=_BACK_MARKUP, parse_mode='Markdown')
     
     async def start_image_generation(self, query, user_id: int):
         """Start the image generation process"""
-        user_sessions[user_id] = {
-            'state': 'awaiting_image_description',
-        }
+        await self._replace_session(user_id, Session(state='awaiting_image_description'))
         
         text = (
             "🖼️ *Generate Custom Image*\n\n"
@@ -451,46 +1309,23 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
             "*Write your image description:*"
         )
         
-        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text(text, reply_markup=_BACK_MARKUP, parse_mode='Markdown')
         
     async def show_how_it_works(self, query):
         """Show how the bot works"""
-        text = (
-            "ℹ️ *How does the carousel generator work?*\n\n"
-            "*Step 1: Content Generation* 🤖\n"
-            "• You provide the carousel topic\n"
-            "• AI creates professional content in 7-card format\n"
-            "• You can approve or request modifications\n\n"
-            "*Step 2: HTML Creation* 🎨\n"
-            "• Content is placed in a beautiful template\n"
-            "• You get a carousel preview\n"
-            "• You can approve or request changes\n\n"
-            "*Step 3: Publishing* 🌐\n"
-            "• I publish the carousel online\n"
-            "• You get a shareable link\n"
-            "• You can immediately share with your followers!\n\n"
-            "The whole process takes 2-3 minutes! 🚀"
-        )
-        
-        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text(_HOW_IT_WORKS_TEXT, reply_markup=_BACK_MARKUP, parse_mode='Markdown')
         
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages based on user state"""
         user_id = update.effective_user.id
         message_text = update.message.text
         
-        if user_id not in user_sessions:
+        session = await self.sessions.get(user_id)
+        if session is None:
             await self.start_command(update, context)
             return
             
-        session = user_sessions[user_id]
-        state = session.get('state')
+        state = session.state
         
         if state == 'awaiting_topic':
             await self.generate_content(update, user_id, message_text)
@@ -509,7 +1344,8 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
         """Handle voice messages by transcribing them with Whisper and processing as text"""
         user_id = update.effective_user.id
         
-        if user_id not in user_sessions:
+        session = await self.sessions.get(user_id)
+        if session is None:
             await self.start_command(update, context)
             return
         
@@ -554,8 +1390,7 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
             await processing_msg.edit_text(f"🎤 Transcribed: \"{transcribed_text}\"\n\n⏳ Processing your request...")
             
             # Process the transcribed text as if it were a regular text message
-            session = user_sessions[user_id]
-            state = session.get('state')
+            state = session.state
             
             if state == 'awaiting_topic':
                 await self.generate_content_from_voice(update, user_id, transcribed_text, processing_msg)
@@ -573,7 +1408,7 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
                 await processing_msg.edit_text(f"🎤 Transcribed: \"{transcribed_text}\"\n\n❓ I'm not sure what to do with this. Please use the menu buttons to navigate.")
                 
         except Exception as e:
-            logger.error(f"Error processing voice message: {e}")
+            logger.error("Error processing voice message: %s", e)
             await processing_msg.edit_text("❌ Error processing voice message. Please try again or send a text message.")
     
     async def generate_content_from_voice(self, update: Update, user_id: int, topic: str, processing_msg):
@@ -582,7 +1417,7 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
             await processing_msg.edit_text(f"🎤 Transcribed: \"{topic}\"\n\n🤖 Generating carousel content...")
             await self.generate_content(update, user_id, topic)
         except Exception as e:
-            logger.error(f"Error generating content from voice: {e}")
+            logger.error("Error generating content from voice: %s", e)
             await processing_msg.edit_text("❌ Error generating content. Please try again.")
     
     async def generate_image_from_voice(self, update: Update, user_id: int, description: str, processing_msg):
@@ -591,7 +1426,7 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
             await processing_msg.edit_text(f"🎤 Transcribed: \"{description}\"\n\n🎨 Generating image...")
             await self.generate_image(update, user_id, description)
         except Exception as e:
-            logger.error(f"Error generating image from voice: {e}")
+            logger.error("Error generating image from voice: %s", e)
             await processing_msg.edit_text("❌ Error generating image. Please try again.")
     
     async def generate_slide_image_from_voice(self, update: Update, user_id: int, description: str, processing_msg):
@@ -600,7 +1435,7 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
             await processing_msg.edit_text(f"🎤 Transcribed: \"{description}\"\n\n🎨 Generating slide image...")
             await self.generate_slide_image(update, user_id, description)
         except Exception as e:
-            logger.error(f"Error generating slide image from voice: {e}")
+            logger.error("Error generating slide image from voice: %s", e)
             await processing_msg.edit_text("❌ Error generating slide image. Please try again.")
     
     async def modify_content_from_voice(self, update: Update, user_id: int, modifications: str, processing_msg):
@@ -609,7 +1444,7 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
             await processing_msg.edit_text(f"🎤 Transcribed: \"{modifications}\"\n\n✏️ Modifying content...")
             await self.modify_content(update, user_id, modifications)
         except Exception as e:
-            logger.error(f"Error modifying content from voice: {e}")
+            logger.error("Error modifying content from voice: %s", e)
             await processing_msg.edit_text("❌ Error modifying content. Please try again.")
     
     async def modify_html_content_from_voice(self, update: Update, user_id: int, modifications: str, processing_msg):
@@ -618,109 +1453,86 @@ IMPORTANT: Respond ONLY with valid JSON. No additional text or explanations.
             await processing_msg.edit_text(f"🎤 Transcribed: \"{modifications}\"\n\n✏️ Modifying HTML content...")
             await self.modify_html_content(update, user_id, modifications)
         except Exception as e:
-            logger.error(f"Error modifying HTML content from voice: {e}")
+            logger.error("Error modifying HTML content from voice: %s", e)
             await processing_msg.edit_text("❌ Error modifying HTML content. Please try again.")
             
     async def generate_content(self, update: Update, user_id: int, topic: str):
         """Generate carousel content using Claude"""
+        if not self._allow_user_request(user_id):
+            await update.message.reply_text(_RATE_LIMITED_TEXT)
+            return
+        
         # Show loading message
         loading_msg = await update.message.reply_text("🤖 Generating carousel content... This may take a moment.")
         
         try:
-            # Read the appropriate prompt template based on style
-            session = user_sessions[user_id]
-            style = session.get('style', 'style_1')
-            
-            if style == 'style_2':
-                prompt_path = Path("project/assets/style_2_content_creation_prompt.txt")
-            else:
-                prompt_path = Path("project/assets/content_creation_prompt.txt")
-                
-            async with aiofiles.open(prompt_path, 'r', encoding='utf-8') as f:
-                prompt_template = await f.read()
+            # Pick the appropriate prompt template based on style
+            session = await self.sessions.get(user_id) or Session()
+            style = session.style
+            prefix, suffix = self._get_prompt_template(style)
             
             # Create the full prompt
-            full_prompt = f"""
-{prompt_template}
-
-TEMAT KARUZELI: {topic}
+            full_prompt = "".join((prefix, topic, suffix))
 
-Stwórz karuzelę na powyższy temat w formacie JSON zgodnie z podanym szablonem. 
-Pamiętaj o:
-- Użyciu formy "ty" 
-- Kontraście między przeszłością a teraźniejszością
-- Konkretnych, relatable przykładach
-- Empatycznym tonie
-- Polskim języku
-- Zwróceniu TYLKO poprawnego JSON-a bez dodatkowych komentarzy
-
-WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekstów, wyjaśnień ani formatowania markdown. Zwróć tylko czysty, poprawny JSON zgodny z szablonem.
-"""
-
-            # Generate content using AI with fallback
-            generated_content = await self.generate_with_ai(full_prompt)
+            # Reuse the response for an identical prompt, otherwise generate using AI with fallback
+            cached_content = await self._get_cached_generation(full_prompt)
+            generated_content = cached_content or await self.generate_with_ai(
+                full_prompt,
+                on_progress=self._progress_reporter(loading_msg, "🤖 Generating carousel content...")
+            )
             
-            # Validate JSON format before proceeding
+            # Unwrap prose or markdown fences around the JSON, then validate before proceeding
+            generated_content = _extract_json(generated_content) or generated_content
             try:
-                # Test if it's valid JSON
-                json.loads(generated_content)
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON received from AI: {e}")
-                logger.error(f"Raw content: {generated_content[:500]}...")
+                # Parse once here and reuse the result for the preview
+                parsed_content = _validate_cards(orjson.loads(generated_content))
+            except (orjson.JSONDecodeError, fastjsonschema.JsonSchemaValueException) as e:
+                logger.error("Invalid JSON received from AI: %s", e)
+                logger.error("Raw content: %.500s...", generated_content)
                 await loading_msg.edit_text(
                     "❌ AI returned invalid format. Please try again or contact the administrator."
                 )
                 return
             
-            # Store in session
-            user_sessions[user_id].update({
-                'state': 'content_review',
-                'topic': topic,
-                'generated_content': generated_content
-            })
+            if not cached_content:
+                await self._cache_generation(full_prompt, generated_content)
             
-            # Delete loading message
-            await loading_msg.delete()
+            # Store in session
+            session.state = 'content_review'
+            session.topic = topic
+            session.generated_content = generated_content
+            session.parsed_content = parsed_content
+            await self.sessions.set(user_id, session)
             
             # Show generated content with approval buttons (format JSON for display)
-            session = user_sessions[user_id]
-            style = session.get('style', 'style_1')
-            
             if style == 'style_2':
-                preview_text = self.json_generator_style2.format_cards_for_display(generated_content)
+                preview_text = self.json_generator_style2.format_cards_for_display(parsed_content)
             else:
-                preview_text = self.json_generator.format_cards_for_display(generated_content)
+                preview_text = self.json_generator.format_cards_for_display(parsed_content)
             
-            keyboard = [
-                [InlineKeyboardButton("✅ Approve Content", callback_data="approve_content")],
-                [InlineKeyboardButton("✏️ Request Modifications", callback_data="modify_content")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = _CONTENT_REVIEW_MARKUP
             
             # Handle long messages by splitting if necessary
             full_message = f"🎯 *Generated Carousel Content:*\n\n{preview_text}"
             
             if len(full_message) > 4000:  # Leave some buffer for Telegram's 4096 limit
-                # Send content in parts
-                await update.message.reply_text("🎯 *Generated Carousel Content:*", parse_mode='Markdown')
+                # Send content in parts, reusing the loading message for the header
+                await loading_msg.edit_text("🎯 *Generated Carousel Content:*", parse_mode='Markdown')
                 
                 # Split content into chunks
                 chunks = self.split_message(preview_text, 3800)
-                for i, chunk in enumerate(chunks):
-                    if i == len(chunks) - 1:  # Last chunk gets the buttons
-                        await update.message.reply_text(chunk, reply_markup=reply_markup, parse_mode='Markdown')
-                    else:
-                        await update.message.reply_text(chunk, parse_mode='Markdown')
+                
+                await self._reply_in_chunks(update, chunks, reply_markup)
             else:
-                await update.message.reply_text(
+                # Replace the loading message with the preview instead of deleting it and sending a new one
+                await loading_msg.edit_text(
                     full_message,
                     reply_markup=reply_markup,
                     parse_mode='Markdown'
                 )
             
         except Exception as e:
-            logger.error(f"Error generating content: {e}")
+            logger.error("Error generating content: %s", e)
             await loading_msg.edit_text(
                 "❌ An error occurred while generating content. Please try again or contact the administrator."
             )
@@ -731,104 +1543,19 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
         loading_msg = await update.message.reply_text("🎨 Generating your image with AI... This may take up to 2 minutes for high-quality results.")
         
         try:
-            # Read the image generation prompt template
-            prompt_path = Path("project/assets/image_generation_prompt.txt")
-            async with aiofiles.open(prompt_path, 'r', encoding='utf-8') as f:
-                prompt_template = await f.read()
+            prefix, suffix = self._get_prompt_template('image')
             
-            # Create the full prompt by replacing the placeholder
-            full_prompt = prompt_template.replace('{USER_INPUT}', description)
+            # Create the full prompt around the user's description
+            full_prompt = "".join((prefix, description, suffix))
             
-            # Generate image using OpenRouter with Gemini 2.5 Flash Image Preview
-            if openrouter_client:
-                logger.info("Generating standalone image with Gemini 2.5 Flash Image Preview...")
-                
-                payload = {
-                    "model": "google/gemini-2.5-flash-image-preview",
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": f"Please generate an image based on this description: {full_prompt}"
-                                }
-                            ]
-                        }
-                    ],
-                    "max_tokens": 1000,
-                    "temperature": 0.7
-                }
-                
-                try:
-                    # Add retry logic for timeout issues
-                    max_retries = 2
-                    for attempt in range(max_retries):
-                        try:
-                            logger.info(f"OpenRouter API attempt {attempt + 1}/{max_retries}")
-                            response = await openrouter_client.post("/chat/completions", json=payload)
-                            response_data = response.json()
-                            
-                            if response.status_code == 200 and "choices" in response_data:
-                                # Extract image URL from response
-                                message = response_data["choices"][0]["message"]
-                                image_url = self.extract_image_from_gemini_response(message)
-                                logger.info("Gemini standalone image generation successful")
-                                break
-                            else:
-                                logger.error(f"OpenRouter API error: {response_data}")
-                                if attempt == max_retries - 1:
-                                    raise Exception("Failed to generate image with OpenRouter")
-                                continue
-                                
-                        except httpx.TimeoutException as e:
-                            logger.warning(f"OpenRouter timeout on attempt {attempt + 1}: {e}")
-                            if attempt == max_retries - 1:
-                                logger.error("OpenRouter timeout after all retries, falling back to DALL-E")
-                                raise Exception("OpenRouter timeout - falling back to DALL-E")
-                            continue
-                        except httpx.RequestError as e:
-                            logger.warning(f"OpenRouter request error on attempt {attempt + 1}: {e}")
-                            if attempt == max_retries - 1:
-                                raise Exception("OpenRouter request failed - falling back to DALL-E")
-                            continue
-                            
-                except Exception as e:
-                    logger.warning(f"OpenRouter failed: {e}, falling back to DALL-E")
-                    # Fall through to DALL-E fallback
-                    if openai_client:
-                        logger.info("Falling back to DALL-E...")
-                        response = await openai_client.images.generate(
-                            model="dall-e-3",
-                            prompt=full_prompt,
-                            size="1024x1024",
-                            quality="standard",
-                            n=1,
-                        )
-                        
-                        image_url = response.data[0].url
-                        logger.info("DALL-E fallback generation successful")
-                    else:
-                        raise Exception("Both OpenRouter and DALL-E are unavailable")
-            elif openai_client:
-                # Fallback to DALL-E if OpenRouter is not available
-                logger.info("OpenRouter not available, falling back to DALL-E...")
-                response = await openai_client.images.generate(
-                    model="dall-e-3",
-                    prompt=full_prompt,
-                    size="1024x1024",
-                    quality="standard",
-                    n=1,
-                )
-                
-                image_url = response.data[0].url
-                logger.info("DALL-E standalone generation successful")
-            else:
+            if not (openrouter_client or openai_client):
                 await loading_msg.edit_text(
                     "❌ Image generation is not available. Please contact the administrator."
                 )
                 return
             
+            image_url = await self._generate_image(full_prompt)
+            
             # Send the generated image
             try:
                 await update.message.reply_photo(
@@ -836,10 +1563,10 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                     caption=f"🖼️ *Generated Image*\n\n*Description:* {description}\n\n*Generated with AI*",
                     parse_mode='Markdown'
                 )
-                # Delete loading message only after successful image send
-                await loading_msg.delete()
+                # Delete loading message only after successful image send, overlapping the follow-up reply
+                self._delete_in_background(loading_msg)
             except Exception as photo_error:
-                logger.error(f"Error sending photo: {photo_error}")
+                logger.error("Error sending photo: %s", photo_error)
                 # If photo fails, edit the loading message instead of deleting it
                 await loading_msg.edit_text(
                     f"🖼️ *Image Generated Successfully!*\n\n"
@@ -851,26 +1578,18 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                 )
             
             # Reset user session to main menu
-            user_sessions[user_id] = {'state': 'main_menu'}
+            await self._replace_session(user_id, Session(state='main_menu'))
             
             # Show main menu again
-            keyboard = [
-                [InlineKeyboardButton("🎨 Create New Carousel", callback_data="create_carousel")],
-                [InlineKeyboardButton("🖼️ Generate Image", callback_data="generate_image")],
-                [InlineKeyboardButton("📚 My History", callback_data="show_history")],
-                [InlineKeyboardButton("ℹ️ How It Works", callback_data="how_it_works")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             await update.message.reply_text(
                 "✅ *Image generated successfully!*\n\nWhat would you like to do next?",
-                reply_markup=reply_markup,
+                reply_markup=_MAIN_MENU_MARKUP,
                 parse_mode='Markdown'
             )
                 
         except Exception as e:
-            logger.error(f"Error generating standalone image: {e}")
-            logger.error(f"Full error traceback:", exc_info=True)
+            logger.error("Error generating standalone image: %s", e)
+            logger.error("Full error traceback:", exc_info=True)
             try:
                 await loading_msg.edit_text(
                     f"❌ An error occurred while generating the image.\n\n"
@@ -878,7 +1597,7 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                     f"Please try again or contact the administrator."
                 )
             except Exception as edit_error:
-                logger.error(f"Error editing loading message: {edit_error}")
+                logger.error("Error editing loading message: %s", edit_error)
                 # Send a new message if editing fails
                 await update.message.reply_text(
                     f"❌ An error occurred while generating the image.\n\n"
@@ -887,51 +1606,88 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                 )
             
     
+    async def _reply_in_chunks(self, update: Update, chunks: List[str], reply_markup: InlineKeyboardMarkup):
+        """Send a long preview as several replies, attaching the buttons to the last one"""
+        # Body chunks go out one after another so the cards arrive in order; only the last one notifies
+        for chunk in chunks[:-1]:
+            await update.message.reply_text(chunk, parse_mode='Markdown', disable_notification=True)
+        # The last chunk gets the buttons and goes out last
+        await update.message.reply_text(chunks[-1], reply_markup=reply_markup, parse_mode='Markdown')
+    
     def split_message(self, text: str, max_length: int) -> List[str]:
-        """Split long text into chunks that fit Telegram's message limit"""
+        """Split long text into chunks that fit Telegram's message limit, keeping paragraphs (cards) whole"""
         if len(text) <= max_length:
             return [text]
         
         chunks = []
-        lines = text.split('\n')
-        current_chunk = ""
+        current = []
+        current_len = 0
+        
+        # Greedily pack whole paragraphs so Markdown entities within a card are never cut apart
+        for paragraph in _PARAGRAPH_BOUNDARY_RE.split(text):
+            if current_len + len(paragraph) > max_length:
+                if current:
+                    chunks.append("".join(current).strip())
+                    current, current_len = [], 0
+                
+                if len(paragraph) > max_length:
+                    # A single paragraph is too long: split it by lines and keep the remainder for the next chunk
+                    separator = paragraph[len(paragraph.rstrip('\n')):]
+                    *full_chunks, paragraph = self._split_lines(paragraph, max_length) or [""]
+                    chunks.extend(full_chunks)
+                    paragraph += separator
+            
+            current.append(paragraph)
+            current_len += len(paragraph)
+        
+        last_chunk = "".join(current).strip()
+        if last_chunk:
+            chunks.append(last_chunk)
         
-        for line in lines:
+        return [chunk for chunk in chunks if chunk]
+    
+    def _split_lines(self, text: str, max_length: int) -> List[str]:
+        """Split text into chunks at line boundaries, cutting lines that are longer than a chunk"""
+        chunks = []
+        current_lines = []
+        current_len = 0  # Length the chunk would have with a newline after every line
+        
+        for line in text.split('\n'):
             # If adding this line would exceed the limit
-            if len(current_chunk) + len(line) + 1 > max_length:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = line + '\n'
-                else:
-                    # Single line is too long, split it
-                    while len(line) > max_length:
-                        chunks.append(line[:max_length])
-                        line = line[max_length:]
-                    current_chunk = line + '\n'
+            if current_len + len(line) + 1 > max_length:
+                if current_lines:
+                    chunks.append('\n'.join(current_lines).strip())
+                # A line longer than a chunk is cut, keeping the remainder as the start of the next chunk
+                cut = (len(line) - 1) // max_length * max_length
+                chunks.extend(line[i:i + max_length] for i in range(0, cut, max_length))
+                line = line[cut:]
+                current_lines = [line]
+                current_len = len(line) + 1
             else:
-                current_chunk += line + '\n'
+                current_lines.append(line)
+                current_len += len(line) + 1
         
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
+        last_chunk = '\n'.join(current_lines).strip()
+        if last_chunk:
+            chunks.append(last_chunk)
         
         return chunks
         
     async def approve_content(self, query, user_id: int):
         """User approved the generated content, proceed to image generation for first slide"""
-        session = user_sessions[user_id]
+        session = await self.sessions.get(user_id) or Session()
         
         # Show loading message while analyzing content
         await query.edit_message_text("🤖 Analyzing your content to suggest relevant images...")
         
         try:
             # Generate AI-suggested image descriptions based on content
-            suggested_images = await self.generate_image_suggestions(session['generated_content'])
+            suggested_images = await self.generate_image_suggestions(session.parsed_content or session.generated_content)
             
             # Update session state to image description
-            session.update({
-                'state': 'awaiting_image_description_for_slide',
-                'suggested_images': suggested_images
-            })
+            session.state = 'awaiting_image_description_for_slide'
+            session.suggested_images = suggested_images
+            await self.sessions.set(user_id, session)
             
             text = (
                 "🖼️ *Create Image for First Slide*\n\n"
@@ -940,20 +1696,13 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                 "*You can use one of these suggestions or describe your own image:*"
             )
             
-            keyboard = [
-                [InlineKeyboardButton("⏭️ Skip Image (Use Default)", callback_data="skip_image")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+            await query.edit_message_text(text, reply_markup=_SKIP_DEFAULT_IMAGE_MARKUP, parse_mode='Markdown')
             
         except Exception as e:
-            logger.error(f"Error generating image suggestions: {e}")
+            logger.error("Error generating image suggestions: %s", e)
             # Fallback to original message if AI analysis fails
-            session.update({
-                'state': 'awaiting_image_description_for_slide'
-            })
+            session.state = 'awaiting_image_description_for_slide'
+            await self.sessions.set(user_id, session)
             
             text = (
                 "🖼️ *Create Image for First Slide*\n\n"
@@ -966,19 +1715,13 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                 "*Describe your desired image:*"
             )
             
-            keyboard = [
-                [InlineKeyboardButton("⏭️ Skip Image (Use Default)", callback_data="skip_image")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+            await query.edit_message_text(text, reply_markup=_SKIP_DEFAULT_IMAGE_MARKUP, parse_mode='Markdown')
     
-    async def generate_image_suggestions(self, carousel_content: str) -> str:
-        """Generate AI-suggested image descriptions based on carousel content"""
+    async def generate_image_suggestions(self, carousel_content: Dict | str) -> str:
+        """Generate AI-suggested image descriptions based on carousel content (parsed cards or raw JSON)"""
         try:
-            # Parse the JSON content to extract the main theme and message
-            cards_data = json.loads(carousel_content)
+            # Content validated at generation time is already parsed; only older sessions need the JSON decoded
+            cards_data = carousel_content if isinstance(carousel_content, dict) else orjson.loads(carousel_content)
             cards = cards_data.get('cards', [])
             
             # Extract key information from the carousel
@@ -1016,13 +1759,23 @@ Each description should be:
 Focus on symbols like: paths, bridges, mountains, trees growing, doors opening, light breaking through, geometric patterns representing growth, etc.
 """
 
+            # Approving the same carousel again reuses its suggestions instead of another AI round-trip
+            cache_key = self._generation_cache_key(suggestion_prompt)
+            cached = self._suggestions_cache.get(cache_key) or await self._get_cached_generation(suggestion_prompt)
+            if cached:
+                self._suggestions_cache[cache_key] = cached
+                return cached
+            
             # Generate suggestions using AI
-            suggestions = await self.generate_with_ai(suggestion_prompt)
+            suggestions = await self.generate_with_ai(suggestion_prompt, max_tokens=SUGGESTIONS_MAX_TOKENS, json_mode=False)
+            suggestions = suggestions.strip()
             
-            return suggestions.strip()
+            self._suggestions_cache[cache_key] = suggestions
+            await self._cache_generation(suggestion_prompt, suggestions, ttl=SUGGESTIONS_CACHE_TTL)
+            return suggestions
             
         except Exception as e:
-            logger.error(f"Error in generate_image_suggestions: {e}")
+            logger.error("Error in generate_image_suggestions: %s", e)
             # Return fallback suggestions
             return (
                 "• A winding path leading upward through minimalist landscape\n"
@@ -1035,26 +1788,24 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
         """Download image from external URL and save it locally"""
         try:
             # Generate unique filename
-            image_id = str(uuid.uuid4())
+            image_id = uuid.uuid4().hex
             filename = f"slide_image_{user_id}_{image_id}.png"
             local_path = static_dir / filename
             
-            # Download the image
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(image_url)
-                response.raise_for_status()
-                
-                # Save the image locally
-                async with aiofiles.open(local_path, 'wb') as f:
-                    await f.write(response.content)
+            # Download the image over the shared pool so repeat downloads skip the TCP/TLS handshake
+            response = await download_client.get(image_url)
+            response.raise_for_status()
+            
+            # Save the image locally in one stdlib write on a worker thread
+            await asyncio.to_thread(local_path.write_bytes, response.content)
             
             # Return the local URL that will be accessible from your server
             local_url = f"{BASE_URL}/static/{filename}"
-            logger.info(f"Image downloaded and saved: {local_url}")
+            logger.info("Image downloaded and saved: %s", local_url)
             return local_url
             
         except Exception as e:
-            logger.error(f"Error downloading image: {e}")
+            logger.error("Error downloading image: %s", e)
             # Fallback to original URL if download fails
             return image_url
     
@@ -1065,12 +1816,12 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
             local_image_url = await self.download_and_save_image(image_url, user_id)
             
             # Store both original and local URLs in session
-            user_sessions[user_id].update({
-                'state': 'reviewing_slide_image',
-                'slide_image_url': local_image_url,  # Use local URL for HTML
-                'original_image_url': image_url,     # Keep original for Telegram
-                'slide_image_description': description
-            })
+            session = await self.sessions.get(user_id) or Session()
+            session.state = 'reviewing_slide_image'
+            session.slide_image_url = local_image_url  # Use local URL for HTML
+            session.original_image_url = image_url     # Keep original for Telegram
+            session.slide_image_description = description
+            await self.sessions.set(user_id, session)
             
             # Send the generated image for approval (use original URL for Telegram)
             await update.message.reply_photo(
@@ -1078,10 +1829,10 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
                 caption=f"🖼️ *Generated Image for First Slide*\n\n*Description:* {description}\n\nDo you like this image for your carousel's first slide?",
                 parse_mode='Markdown'
             )
-            # Delete loading message only after successful image send
-            await loading_msg.delete()
+            # Delete loading message only after successful image send, overlapping the approval buttons
+            self._delete_in_background(loading_msg)
         except Exception as photo_error:
-            logger.error(f"Error sending carousel image: {photo_error}")
+            logger.error("Error sending carousel image: %s", photo_error)
             # If photo fails, edit the loading message instead of deleting it
             await loading_msg.edit_text(
                 f"🖼️ *Image Generated for First Slide!*\n\n"
@@ -1094,17 +1845,9 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
             )
         
         # Show approval buttons
-        keyboard = [
-            [InlineKeyboardButton("✅ Use This Image", callback_data="approve_slide_image")],
-            [InlineKeyboardButton("🔄 Generate New Image", callback_data="decline_slide_image")],
-            [InlineKeyboardButton("🔗 Use Custom URL", callback_data="use_custom_url")],
-            [InlineKeyboardButton("⏭️ Skip Image", callback_data="skip_image")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
             "Choose an option:",
-            reply_markup=reply_markup
+            reply_markup=_IMAGE_APPROVAL_MARKUP
         )
 
     async def generate_slide_image(self, update: Update, user_id: int, description: str):
@@ -1113,131 +1856,31 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
         loading_msg = await update.message.reply_text("🎨 Generating your slide image with AI... This may take up to 2 minutes for high-quality results.")
         
         try:
-            logger.info(f"Starting carousel image generation for description: {description}")
-            logger.info(f"OpenRouter client available: {openrouter_client is not None}")
-            logger.info(f"OpenAI client available: {openai_client is not None}")
-            
-            # Read the image generation prompt template
-            prompt_path = Path("project/assets/image_generation_prompt.txt")
-            logger.info(f"Reading prompt template from: {prompt_path}")
-            async with aiofiles.open(prompt_path, 'r', encoding='utf-8') as f:
-                prompt_template = await f.read()
-            
-            # Create the full prompt by replacing the placeholder
-            full_prompt = prompt_template.replace('{USER_INPUT}', description)
-            logger.info(f"Generated full prompt for carousel: {full_prompt[:100]}...")
-            
-            # Generate image using OpenRouter with Gemini 2.5 Flash Image Preview
-            if openrouter_client:
-                logger.info("Generating slide image with Gemini 2.5 Flash Image Preview...")
-                
-                payload = {
-                    "model": "google/gemini-2.5-flash-image-preview",
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": f"Please generate an image based on this description: {full_prompt}"
-                                }
-                            ]
-                        }
-                    ],
-                    "max_tokens": 1000,
-                    "temperature": 0.7
-                }
-                
-                try:
-                    # Add retry logic for timeout issues
-                    max_retries = 2
-                    for attempt in range(max_retries):
-                        try:
-                            logger.info(f"OpenRouter API attempt {attempt + 1}/{max_retries}")
-                            response = await openrouter_client.post("/chat/completions", json=payload)
-                            logger.info(f"OpenRouter response status: {response.status_code}")
-                            response_data = response.json()
-                            logger.info(f"OpenRouter response keys: {list(response_data.keys())}")
-                            
-                            if response.status_code == 200 and "choices" in response_data:
-                                # Extract image URL from response
-                                message = response_data["choices"][0]["message"]
-                                logger.info(f"Message structure: {list(message.keys())}")
-                                image_url = self.extract_image_from_gemini_response(message)
-                                logger.info(f"Extracted image URL: {image_url[:50]}...")
-                                logger.info("Gemini carousel image generation successful")
-                                
-                                # Send image for approval and return
-                                await self.send_image_for_approval(update, user_id, image_url, description, loading_msg)
-                                return  # Important: return here to avoid continuing to fallback code
-                                
-                                break
-                            else:
-                                logger.error(f"OpenRouter API error - Status: {response.status_code}")
-                                logger.error(f"Response data: {response_data}")
-                                if attempt == max_retries - 1:
-                                    raise Exception("Failed to generate image with OpenRouter")
-                                continue
-                                
-                        except httpx.TimeoutException as e:
-                            logger.warning(f"OpenRouter timeout on attempt {attempt + 1}: {e}")
-                            if attempt == max_retries - 1:
-                                logger.error("OpenRouter timeout after all retries, falling back to DALL-E")
-                                raise Exception("OpenRouter timeout - falling back to DALL-E")
-                            continue
-                        except httpx.RequestError as e:
-                            logger.warning(f"OpenRouter request error on attempt {attempt + 1}: {e}")
-                            if attempt == max_retries - 1:
-                                raise Exception("OpenRouter request failed - falling back to DALL-E")
-                            continue
-                            
-                except Exception as e:
-                    logger.warning(f"OpenRouter failed: {e}, falling back to DALL-E")
-                    # Fall through to DALL-E fallback
-                    if openai_client:
-                        logger.info("Falling back to DALL-E...")
-                        response = await openai_client.images.generate(
-                            model="dall-e-3",
-                            prompt=full_prompt,
-                            size="1024x1024",
-                            quality="standard",
-                            n=1,
-                        )
-                        
-                        image_url = response.data[0].url
-                        logger.info("DALL-E fallback generation successful")
-                        
-                        # Send image for approval
-                        await self.send_image_for_approval(update, user_id, image_url, description, loading_msg)
-                        return
-                    else:
-                        raise Exception("Both OpenRouter and DALL-E are unavailable")
-            elif openai_client:
-                # Fallback to DALL-E if OpenRouter is not available
-                logger.info("OpenRouter not available, falling back to DALL-E...")
-                response = await openai_client.images.generate(
-                    model="dall-e-3",
-                    prompt=full_prompt,
-                    size="1024x1024",
-                    quality="standard",
-                    n=1,
-                )
-                
-                image_url = response.data[0].url
-                logger.info("DALL-E fallback generation successful")
-                
-                # Send image for approval
-                await self.send_image_for_approval(update, user_id, image_url, description, loading_msg)
-                return
-                
-            else:
+            logger.info("Starting carousel image generation for description: %s", description)
+            logger.info("OpenRouter client available: %s", openrouter_client is not None)
+            logger.info("OpenAI client available: %s", openai_client is not None)
+            
+            prefix, suffix = self._get_prompt_template('image')
+            
+            # Create the full prompt around the user's description
+            full_prompt = "".join((prefix, description, suffix))
+            logger.info("Generated full prompt for carousel: %.100s...", full_prompt)
+            
+            if not (openrouter_client or openai_client):
                 await loading_msg.edit_text(
                     "❌ Image generation is not available. Please contact the administrator."
                 )
+                return
+            
+            image_url = await self._generate_image(full_prompt)
+            logger.info("Extracted image URL: %.50s...", image_url)
+            
+            # Send image for approval
+            await self.send_image_for_approval(update, user_id, image_url, description, loading_msg)
                 
         except Exception as e:
-            logger.error(f"Error generating slide image: {e}")
-            logger.error(f"Full error traceback:", exc_info=True)
+            logger.error("Error generating slide image: %s", e)
+            logger.error("Full error traceback:", exc_info=True)
             try:
                 await loading_msg.edit_text(
                     f"❌ An error occurred while generating the image.\n\n"
@@ -1245,7 +1888,7 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
                     f"Please try again or contact the administrator."
                 )
             except Exception as edit_error:
-                logger.error(f"Error editing loading message: {edit_error}")
+                logger.error("Error editing loading message: %s", edit_error)
                 # Send a new message if editing fails
                 await update.message.reply_text(
                     f"❌ An error occurred while generating the image.\n\n"
@@ -1253,7 +1896,142 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
                     f"Please try again or contact the administrator."
                 )
     
-    def extract_image_from_gemini_response(self, message: dict) -> str:
+    async def _generate_with_openrouter(self, full_prompt: str) -> str:
+        """Generate an image with Gemini 2.5 Flash Image Preview via OpenRouter, retrying transient failures"""
+        logger.info("Generating image with Gemini 2.5 Flash Image Preview...")
+        
+        payload = {
+            **_OPENROUTER_IMAGE_PAYLOAD,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": f"Please generate an image based on this description: {full_prompt}"
+                        }
+                    ]
+                }
+            ]
+        }
+        
+        response = await self._post_openrouter(payload)
+        if response.status_code == 200:
+            # Image replies can be megabytes of base64; parse the raw bytes and skip the text decode
+            response_data = orjson.loads(response.content)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("OpenRouter response keys: %s", list(response_data))
+            
+            if response_data.get("choices"):
+                # Extract image URL from response
+                message = response_data["choices"][0]["message"]
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Message structure: %s", list(message))
+                return await self.extract_image_from_gemini_response(message)
+        
+        # Only a snippet of the body is needed to diagnose the failure
+        logger.error("OpenRouter API error - Status: %s, body: %r", response.status_code, response.content[:500])
+        raise Exception("Failed to generate image with OpenRouter")
+    
+    async def _post_openrouter(self, payload: dict, max_retries: int = 3) -> httpx.Response:
+        """POST a chat completion to OpenRouter, retrying timeouts, 429s and 5xx with jittered exponential backoff"""
+        for attempt in range(max_retries):
+            if attempt:
+                # Spread retries out so concurrent users don't hit a struggling provider in lockstep
+                await asyncio.sleep(min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+            
+            last_attempt = attempt == max_retries - 1
+            try:
+                logger.info("OpenRouter API attempt %s/%s", attempt + 1, max_retries)
+                async with self._openrouter_sem:
+                    # Hold requests back while OpenRouter has asked us to slow down
+                    delay = self._openrouter_resume_at - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    async with self._openrouter_limiter:
+                        response = await openrouter_client.post("/chat/completions", json=payload)
+            except httpx.TimeoutException as e:
+                logger.warning("OpenRouter timeout on attempt %s: %s", attempt + 1, e)
+                if last_attempt:
+                    raise
+                continue
+            except httpx.RequestError as e:
+                logger.warning("OpenRouter request error on attempt %s: %s", attempt + 1, e)
+                if last_attempt:
+                    raise
+                continue
+            
+            logger.info("OpenRouter response status: %s", response.status_code)
+            
+            if response.status_code == 429:
+                # Pause every caller for the advertised period (seconds form only; default otherwise)
+                retry_after = response.headers.get("retry-after", "")
+                pause = float(retry_after) if retry_after.isdigit() else 5.0
+                self._openrouter_resume_at = max(self._openrouter_resume_at, time.monotonic() + pause)
+                logger.warning("OpenRouter rate limited, pausing image requests for %ss", pause)
+            
+            # Rate limits and server errors are worth another try; other client errors are returned as-is
+            if (response.status_code == 429 or response.status_code >= 500) and not last_attempt:
+                continue
+            return response
+    
+    async def _generate_with_dalle(self, full_prompt: str) -> str:
+        """Generate an image with DALL-E 3"""
+        response = await openai_client.images.generate(
+            model="dall-e-3",
+            prompt=full_prompt,
+            size="1024x1024",
+            quality="standard",
+            n=1,
+        )
+        return response.data[0].url
+    
+    async def _generate_image(self, full_prompt: str) -> str:
+        """Generate an image with OpenRouter/Gemini, racing DALL-E against it once Gemini is slow or has failed"""
+        providers = []
+        if openrouter_client:
+            providers.append(("Gemini", self._generate_with_openrouter))
+        if openai_client:
+            providers.append(("DALL-E", self._generate_with_dalle))
+        
+        attempts: Dict[asyncio.Task, str] = {}
+        
+        def launch():
+            name, generate = providers.pop(0)
+            attempts[asyncio.create_task(generate(full_prompt))] = name
+        
+        launch()
+        try:
+            while attempts:
+                # Only wait for the hedge delay while there is still a provider to race
+                timeout = IMAGE_HEDGE_DELAY if providers else None
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info("No image after %ss, racing %s against it", IMAGE_HEDGE_DELAY, providers[0][0])
+                    launch()
+                    continue
+                
+                for task in done:
+                    name = attempts.pop(task)
+                    try:
+                        image_url = task.result()
+                    except Exception as e:
+                        logger.warning("%s image generation failed: %s", name, e)
+                    else:
+                        logger.info("%s image generation successful", name)
+                        return image_url
+                
+                # Fall back to the next provider unless another attempt is still running
+                if not attempts and providers:
+                    launch()
+        finally:
+            # The slower provider's attempt is cancelled once an image is in hand
+            for task in attempts:
+                task.cancel()
+        
+        raise Exception("Both OpenRouter and DALL-E are unavailable")
+    
+    async def extract_image_from_gemini_response(self, message: dict) -> str:
         """Extract image URL from Gemini response message"""
         try:
             # Check if the message has images array (new format)
@@ -1266,7 +2044,7 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
                     # Check if it's base64 data
                     if image_data.startswith('data:image/'):
                         # Convert base64 to a temporary file and return URL
-                        return self.handle_base64_image(image_data)
+                        return await self.handle_base64_image(image_data)
                     else:
                         # Direct URL
                         return image_data
@@ -1279,13 +2057,12 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
                     return content.strip()
                 
                 # If the response contains markdown image format
-                import re
-                url_match = re.search(r'!\[.*?\]\((https?://[^\)]+)\)', content)
+                url_match = _MD_IMAGE_RE.search(content)
                 if url_match:
                     return url_match.group(1)
                 
                 # If the response contains just a URL in text
-                url_match = re.search(r'https?://[^\s]+', content)
+                url_match = _URL_RE.search(content)
                 if url_match:
                     return url_match.group(0)
             
@@ -1293,58 +2070,59 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
             raise Exception(f"Could not extract image URL from Gemini response. Message structure: {message}")
             
         except Exception as e:
-            logger.error(f"Error extracting image URL: {e}")
-            logger.error(f"Message data: {message}")
+            logger.error("Error extracting image URL: %s", e)
+            logger.error("Message data: %.500s", message)
             raise Exception(f"Failed to extract image URL from response: {e}")
     
-    def handle_base64_image(self, base64_data: str) -> str:
+    async def handle_base64_image(self, base64_data: str) -> str:
         """Convert base64 image data to a temporary file and return public URL"""
         try:
-            logger.info(f"Processing base64 image data (length: {len(base64_data)})")
-            import base64
-            import uuid
-            from pathlib import Path
-            
-            # Extract the base64 data (remove data:image/png;base64, prefix)
-            if ',' in base64_data:
-                header, encoded_data = base64_data.split(',', 1)
-                
-                # Determine file extension from header
-                if 'png' in header:
-                    ext = 'png'
-                elif 'jpeg' in header or 'jpg' in header:
-                    ext = 'jpg'
-                elif 'webp' in header:
-                    ext = 'webp'
-                else:
-                    ext = 'png'  # default
-                
-                # Decode base64 data
-                image_bytes = base64.b64decode(encoded_data)
-                
-                # Create unique filename
-                image_id = str(uuid.uuid4())
-                filename = f"generated_image_{image_id}.{ext}"
-                
-                # Save to static directory
-                static_dir = Path("static")
-                static_dir.mkdir(exist_ok=True)
-                
-                file_path = static_dir / filename
-                with open(file_path, 'wb') as f:
-                    f.write(image_bytes)
-                
-                # Return public URL
-                public_url = f"{BASE_URL}/static/{filename}"
-                logger.info(f"Base64 image saved as: {public_url}")
-                return public_url
-            else:
+            logger.info("Processing base64 image data (length: %s)", len(base64_data))
+            
+            # Locate the end of the data URL header (data:image/png;base64,) instead of splitting off a copy of the payload
+            comma = base64_data.find(',')
+            if comma < 0:
                 raise Exception("Invalid base64 data format")
-                
+            header = base64_data[:comma]
+            
+            # Determine file extension from header
+            if 'png' in header:
+                ext = 'png'
+            elif 'jpeg' in header or 'jpg' in header:
+                ext = 'jpg'
+            elif 'webp' in header:
+                ext = 'webp'
+            else:
+                ext = 'png'  # default
+            
+            # Hand the payload to the image writer; it names the file after the image's content hash
+            written = asyncio.get_running_loop().create_future()
+            await self._image_queue.put((ext, base64_data, comma + 1, written))
+            filename = await written
+            
+            # Return public URL
+            public_url = f"{BASE_URL}/static/{filename}"
+            logger.info("Base64 image saved as: %s", public_url)
+            return public_url
+            
         except Exception as e:
-            logger.error(f"Error handling base64 image: {e}")
+            logger.error("Error handling base64 image: %s", e)
             raise Exception(f"Failed to process base64 image: {e}")
     
+    async def upload_carousel(self, filename: str, html_content: str) -> str:
+        """Upload published carousel HTML to object storage and return its CDN URL"""
+        # Stored uncompressed: S3 can't negotiate Accept-Encoding, so compression is left to the CDN
+        await self.s3.put_object(
+            Bucket=S3_BUCKET,
+            Key=filename,
+            Body=html_content.encode('utf-8'),
+            ContentType="text/html; charset=utf-8",
+            # Each carousel gets a fresh id, so its content never changes
+            CacheControl="public, max-age=31536000, immutable"
+        )
+        
+        return f"{CDN_BASE_URL}/{filename}"
+    
     async def skip_image_generation(self, query, user_id: int):
         """Skip image generation and proceed to HTML creation"""
         await self.proceed_to_html_generation(query, user_id)
@@ -1355,7 +2133,7 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
     
     async def decline_slide_image(self, query, user_id: int):
         """User declined the image, ask for new description"""
-        user_sessions[user_id]['state'] = 'awaiting_image_description_for_slide'
+        await self.sessions.update(user_id, state='awaiting_image_description_for_slide')
         
         text = (
             "🔄 *Generate New Image*\n\n"
@@ -1363,17 +2141,11 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
             "*Describe your desired image:*"
         )
         
-        keyboard = [
-            [InlineKeyboardButton("⏭️ Skip Image", callback_data="skip_image")],
-            [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text(text, reply_markup=_SKIP_BACK_MARKUP, parse_mode='Markdown')
     
     async def request_image_url(self, query, user_id: int):
         """Request custom image URL from user"""
-        user_sessions[user_id]['state'] = 'awaiting_image_url'
+        await self.sessions.update(user_id, state='awaiting_image_url')
         
         text = (
             "🔗 *Provide Custom Image URL*\n\n"
@@ -1385,13 +2157,7 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
             "*Send the image URL:*"
         )
         
-        keyboard = [
-            [InlineKeyboardButton("⏭️ Skip Image", callback_data="skip_image")],
-            [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text(text, reply_markup=_SKIP_BACK_MARKUP, parse_mode='Markdown')
     
     async def process_image_url(self, update: Update, user_id: int, image_url: str):
         """Process custom image URL provided by user"""
@@ -1410,12 +2176,12 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
             local_image_url = await self.download_and_save_image(image_url, user_id)
             
             # Store both URLs in session
-            user_sessions[user_id].update({
-                'state': 'reviewing_slide_image',
-                'slide_image_url': local_image_url,  # Use local URL for HTML
-                'original_image_url': image_url,     # Keep original for reference
-                'slide_image_description': 'Custom image provided by user'
-            })
+            session = await self.sessions.get(user_id) or Session()
+            session.state = 'reviewing_slide_image'
+            session.slide_image_url = local_image_url  # Use local URL for HTML
+            session.original_image_url = image_url     # Keep original for reference
+            session.slide_image_description = 'Custom image provided by user'
+            await self.sessions.set(user_id, session)
             
             # Show confirmation
             await processing_msg.edit_text(
@@ -1427,22 +2193,23 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
             await self.proceed_to_html_generation_from_message(update, user_id)
             
         except Exception as e:
-            logger.error(f"Error processing custom image URL: {e}")
+            logger.error("Error processing custom image URL: %s", e)
             await processing_msg.edit_text(
                 "❌ Error downloading the image. Please check the URL and try again, or skip the image."
             )
     
     async def proceed_to_html_generation(self, query, user_id: int):
         """Proceed to HTML generation with or without custom image"""
-        session = user_sessions[user_id]
-        content = session['generated_content']
+        session = await self.sessions.get(user_id) or Session()
+        # Reuse the cards parsed during validation instead of decoding the JSON again
+        content = session.parsed_content or session.generated_content
         
         # Show loading message
         await query.edit_message_text("🎨 Creating HTML page with your carousel...")
         
         try:
             # Generate HTML from JSON using appropriate generator
-            style = session.get('style', 'style_1')
+            style = session.style
             
             if style == 'style_2':
                 html_content = await self.json_generator_style2.generate_html_from_json(content)
@@ -1450,18 +2217,17 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
                 html_content = await self.json_generator.generate_html_from_json(content)
             
             # If we have a custom slide image, integrate it into the HTML
-            if 'slide_image_url' in session:
-                html_content = self.integrate_slide_image(html_content, session['slide_image_url'], style)
+            if session.slide_image_url:
+                html_content = self.integrate_slide_image(html_content, session.slide_image_url, style)
             
-            # Store HTML in session
-            session.update({
-                'state': 'html_review',
-                'html_content': html_content
-            })
+            # Keep the HTML in a draft file; the session only stores its path
+            await self._save_draft(session, html_content)
+            session.state = 'html_review'
+            await self.sessions.set(user_id, session)
             
             # Create preview text
             image_info = ""
-            if 'slide_image_url' in session:
+            if session.slide_image_url:
                 image_info = "• Custom image on first slide\n"
             
             preview_text = (
@@ -1475,32 +2241,26 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
                 "What would you like to do?"
             )
             
-            keyboard = [
-                [InlineKeyboardButton("✅ Publish Carousel", callback_data="approve_html")],
-                [InlineKeyboardButton("✏️ Request Changes", callback_data="modify_html")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(preview_text, reply_markup=reply_markup, parse_mode='Markdown')
+            await query.edit_message_text(preview_text, reply_markup=_HTML_REVIEW_MARKUP, parse_mode='Markdown')
             
         except Exception as e:
-            logger.error(f"Error generating HTML: {e}")
+            logger.error("Error generating HTML: %s", e)
             await query.edit_message_text(
                 "❌ An error occurred while creating HTML. Please try again."
             )
     
     async def proceed_to_html_generation_from_message(self, update: Update, user_id: int):
         """Proceed to HTML generation from message context (not callback)"""
-        session = user_sessions[user_id]
-        content = session['generated_content']
+        session = await self.sessions.get(user_id) or Session()
+        # Reuse the cards parsed during validation instead of decoding the JSON again
+        content = session.parsed_content or session.generated_content
         
         # Show loading message
         loading_msg = await update.message.reply_text("🎨 Creating HTML page with your carousel...")
         
         try:
             # Generate HTML from JSON using appropriate generator
-            style = session.get('style', 'style_1')
+            style = session.style
             
             if style == 'style_2':
                 html_content = await self.json_generator_style2.generate_html_from_json(content)
@@ -1508,18 +2268,17 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
                 html_content = await self.json_generator.generate_html_from_json(content)
             
             # If we have a custom slide image, integrate it into the HTML
-            if 'slide_image_url' in session:
-                html_content = self.integrate_slide_image(html_content, session['slide_image_url'], style)
+            if session.slide_image_url:
+                html_content = self.integrate_slide_image(html_content, session.slide_image_url, style)
             
-            # Store HTML in session
-            session.update({
-                'state': 'html_review',
-                'html_content': html_content
-            })
+            # Keep the HTML in a draft file; the session only stores its path
+            await self._save_draft(session, html_content)
+            session.state = 'html_review'
+            await self.sessions.set(user_id, session)
             
             # Create preview text
             image_info = ""
-            if 'slide_image_url' in session:
+            if session.slide_image_url:
                 image_info = "• Custom image on first slide\n"
             
             preview_text = (
@@ -1533,17 +2292,10 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
                 "What would you like to do?"
             )
             
-            keyboard = [
-                [InlineKeyboardButton("✅ Publish Carousel", callback_data="approve_html")],
-                [InlineKeyboardButton("✏️ Request Changes", callback_data="modify_html")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await loading_msg.edit_text(preview_text, reply_markup=reply_markup, parse_mode='Markdown')
+            await loading_msg.edit_text(preview_text, reply_markup=_HTML_REVIEW_MARKUP, parse_mode='Markdown')
             
         except Exception as e:
-            logger.error(f"Error generating HTML: {e}")
+            logger.error("Error generating HTML: %s", e)
             await loading_msg.edit_text(
                 "❌ An error occurred while creating HTML. Please try again."
             )
@@ -1572,137 +2324,137 @@ Focus on symbols like: paths, bridges, mountains, trees growing, doors opening,
         
     async def request_modifications(self, query, user_id: int):
         """Request content modifications"""
-        user_sessions[user_id]['state'] = 'awaiting_modifications'
+        await self.sessions.update(user_id, state='awaiting_modifications')
         
-        text = (
-            "✏️ *Content Modification*\n\n"
-            "Describe what changes you'd like to make to the carousel content:\n\n"
-            "• Change tone (more motivational, calmer, etc.)\n"
-            "• Add specific examples\n"
-            "• Change focus to another aspect of the topic\n"
-            "• Other suggestions...\n\n"
-            "*Write your feedback:*"
-        )
-        
-        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text(_MODIFY_REQUEST_TEXT, reply_markup=_BACK_MARKUP, parse_mode='Markdown')
         
     async def modify_content(self, update: Update, user_id: int, modifications: str):
         """Modify content based on user feedback"""
+        if not self._allow_user_request(user_id):
+            await update.message.reply_text(_RATE_LIMITED_TEXT)
+            return
+        
         loading_msg = await update.message.reply_text("🔄 Modifying content according to your feedback...")
         
         try:
-            session = user_sessions[user_id]
-            original_content = session['generated_content']
-            topic = session['topic']
+            session = await self.sessions.get(user_id) or Session()
+            original_content = session.generated_content
+            topic = session.topic
             
             # Create modification prompt
-            modification_prompt = f"""
-Oto oryginalna treść karuzeli na temat "{topic}":
-
-{original_content}
-
-Użytkownik poprosił o następujące modyfikacje:
-{modifications}
-
-Zmodyfikuj treść karuzeli zgodnie z uwagami użytkownika, zachowując oryginalny format JSON i strukturę. 
-WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekstów, wyjaśnień ani formatowania markdown. Zwróć tylko czysty, poprawny JSON zgodny z oryginalnym szablonem.
-"""
+            modification_prompt = _MODIFY_TEMPLATE.format_map({
+                "topic": topic, "original": original_content, "mods": modifications
+            })
 
-            # Generate modified content using AI with fallback
-            modified_content = await self.generate_with_ai(modification_prompt)
+            # Reuse the response for an identical modification, otherwise generate using AI with fallback
+            cached_content = await self._get_cached_generation(modification_prompt)
+            modified_content = cached_content or await self.generate_with_ai(
+                modification_prompt,
+                on_progress=self._progress_reporter(loading_msg, "🔄 Modifying content according to your feedback...")
+            )
             
-            # Validate JSON format before proceeding
+            # Unwrap prose or markdown fences around the JSON, then validate before proceeding
+            modified_content = _extract_json(modified_content) or modified_content
             try:
-                # Test if it's valid JSON
-                json.loads(modified_content)
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON received from AI during modification: {e}")
-                logger.error(f"Raw content: {modified_content[:500]}...")
+                # Parse once here and reuse the result for the preview
+                parsed_content = _validate_cards(orjson.loads(modified_content))
+            except (orjson.JSONDecodeError, fastjsonschema.JsonSchemaValueException) as e:
+                logger.error("Invalid JSON received from AI during modification: %s", e)
+                logger.error("Raw content: %.500s...", modified_content)
                 await loading_msg.edit_text(
                     "❌ AI returned invalid format during modification. Please try again or contact the administrator."
                 )
                 return
             
-            # Update session
-            session.update({
-                'state': 'content_review',
-                'generated_content': modified_content
-            })
+            if not cached_content:
+                await self._cache_generation(modification_prompt, modified_content)
             
-            await loading_msg.delete()
+            # Update session
+            session.state = 'content_review'
+            session.generated_content = modified_content
+            session.parsed_content = parsed_content
+            await self.sessions.set(user_id, session)
             
             # Show modified content (format JSON for display)
-            style = session.get('style', 'style_1')
+            style = session.style
             
             if style == 'style_2':
-                preview_text = self.json_generator_style2.format_cards_for_display(modified_content)
+                preview_text = self.json_generator_style2.format_cards_for_display(parsed_content)
             else:
-                preview_text = self.json_generator.format_cards_for_display(modified_content)
+                preview_text = self.json_generator.format_cards_for_display(parsed_content)
             
-            keyboard = [
-                [InlineKeyboardButton("✅ Approve Content", callback_data="approve_content")],
-                [InlineKeyboardButton("✏️ Request More Changes", callback_data="modify_content")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = _MODIFIED_CONTENT_REVIEW_MARKUP
             
             # Handle long messages by splitting if necessary
             full_message = f"🔄 *Modified Carousel Content:*\n\n{preview_text}"
             
             if len(full_message) > 4000:  # Leave some buffer for Telegram's 4096 limit
-                # Send content in parts
-                await update.message.reply_text("🔄 *Modified Carousel Content:*", parse_mode='Markdown')
+                # Send content in parts, reusing the loading message for the header
+                await loading_msg.edit_text("🔄 *Modified Carousel Content:*", parse_mode='Markdown')
                 
                 # Split content into chunks
                 chunks = self.split_message(preview_text, 3800)
-                for i, chunk in enumerate(chunks):
-                    if i == len(chunks) - 1:  # Last chunk gets the buttons
-                        await update.message.reply_text(chunk, reply_markup=reply_markup, parse_mode='Markdown')
-                    else:
-                        await update.message.reply_text(chunk, parse_mode='Markdown')
+                
+                await self._reply_in_chunks(update, chunks, reply_markup)
             else:
-                await update.message.reply_text(
+                # Replace the loading message with the preview instead of deleting it and sending a new one
+                await loading_msg.edit_text(
                     full_message,
                     reply_markup=reply_markup,
                     parse_mode='Markdown'
                 )
             
         except Exception as e:
-            logger.error(f"Error modifying content: {e}")
+            logger.error("Error modifying content: %s", e)
             await loading_msg.edit_text("❌ An error occurred during modification. Please try again.")
             
     async def request_html_modifications(self, query, user_id: int):
         """Request HTML modifications"""
-        user_sessions[user_id]['state'] = 'awaiting_html_modifications'
-        
-        text = (
-            "🎨 *Appearance Modification*\n\n"
-            "Describe what changes you'd like to make to the carousel appearance:\n\n"
-            "• Change colors (background, text, buttons)\n"
-            "• Adjust font sizes\n"
-            "• Change element layout\n"
-            "• Other stylistic suggestions...\n\n"
-            "*Write your feedback:*"
-        )
-        
-        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        await self.sessions.update(user_id, state='awaiting_html_modifications')
         
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text(_HTML_MODIFY_REQUEST_TEXT, reply_markup=_BACK_MARKUP, parse_mode='Markdown')
         
     async def modify_html_content(self, update: Update, user_id: int, modifications: str):
         """Modify HTML based on user feedback"""
+        if not self._allow_user_request(user_id):
+            await update.message.reply_text(_RATE_LIMITED_TEXT)
+            return
+        
         loading_msg = await update.message.reply_text("🎨 Modifying carousel appearance...")
         
         try:
-            session = user_sessions[user_id]
-            current_html = session['html_content']
+            session = await self.sessions.get(user_id) or Session()
+            current_html = await self._load_draft(session)
+            
+            # Send only the current styles and ask for override rules, not the whole HTML
+            current_css = "\n".join(_STYLE_BLOCK_RE.findall(current_html))
+            css_prompt = _CSS_MODIFY_TEMPLATE.format_map({"css": current_css, "mods": modifications})
+            
+            cached_response = await self._get_cached_generation(css_prompt)
+            response = cached_response or await self.generate_with_ai(
+                css_prompt,
+                on_progress=self._progress_reporter(loading_msg, "🎨 Modifying carousel appearance..."),
+                max_tokens=CSS_MAX_TOKENS
+            )
             
-            # For HTML modifications, we could use Claude to modify CSS
-            # For now, we'll acknowledge the request and keep the original
+            # Claude has no JSON mode, so the object may come wrapped in a code fence or prose
+            response = _extract_json(response) or response
+            try:
+                override_css = orjson.loads(response).get('css')
+            except (orjson.JSONDecodeError, AttributeError) as e:
+                logger.error("Invalid CSS response received from AI: %s", e)
+                override_css = None
+            
+            if not isinstance(override_css, str) or not override_css.strip():
+                logger.error("AI response has no usable 'css' rules")
+                await loading_msg.edit_text("❌ AI returned invalid format. Please try again.")
+                return
+            
+            if not cached_response:
+                await self._cache_generation(css_prompt, response)
+            
+            # Later rules win, so the overrides go last in <head>
+            await self._save_draft(session, current_html.replace("</head>", f"<style>\n{override_css}\n</style>\n</head>", 1))
             
             await loading_msg.delete()
             
@@ -1712,17 +2464,10 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                 "What would you like to do next?"
             )
             
-            keyboard = [
-                [InlineKeyboardButton("✅ Publish Carousel", callback_data="approve_html")],
-                [InlineKeyboardButton("✏️ More Changes", callback_data="modify_html")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+            await update.message.reply_text(text, reply_markup=_MODIFIED_HTML_REVIEW_MARKUP, parse_mode='Markdown')
             
         except Exception as e:
-            logger.error(f"Error modifying HTML: {e}")
+            logger.error("Error modifying HTML: %s", e)
             await loading_msg.edit_text("❌ An error occurred during modification. Please try again.")
             
     async def publish_carousel(self, query, user_id: int):
@@ -1730,38 +2475,51 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
         await query.edit_message_text("🚀 Publishing carousel...")
         
         try:
-            session = user_sessions[user_id]
-            html_content = session['html_content']
+            session = await self.sessions.get(user_id) or Session()
+            draft_path = Path(session.draft_file_path)
+            html_content = await self._load_draft(session)
             
-            # Generate unique filename
-            carousel_id = str(uuid.uuid4())
+            # The draft was named with the carousel id when the HTML was generated
+            carousel_id = session.carousel_id
             filename = f"carousel_{carousel_id}.html"
             
-            # Save HTML file
-            static_dir = Path("static")
-            static_dir.mkdir(exist_ok=True)
-            
-            file_path = static_dir / filename
-            async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-                await f.write(html_content)
+            if self.s3_session:
+                # Serve from the CDN so views never touch the bot host
+                public_url = f"{CDN_BASE_URL}/{filename}"
+                file_path = f"s3://{S3_BUCKET}/{filename}"
+                write = self.upload_carousel(filename, html_content)
+            else:
+                # Save HTML file (static/ is created once at import)
+                file_path = static_dir / filename
+                public_url = f"{BASE_URL}/static/{filename}"
+                write = asyncio.to_thread(_write_published_html, draft_path, file_path, html_content)
+            
+            # The file write and the cache row are independent, so run them together
+            write_result, _ = await asyncio.gather(
+                write,
+                self.cache.save_carousel(
+                    carousel_id=carousel_id,
+                    user_id=user_id,
+                    topic=session.topic,
+                    generated_content=session.generated_content,
+                    html_content=html_content,
+                    public_url=public_url,
+                    file_path=str(file_path)
+                ),
+                return_exceptions=True
+            )
+            if isinstance(write_result, BaseException):
+                # Don't leave a history entry pointing at a file that was never written
+                await self.cache.delete_carousel(carousel_id)
+                raise write_result
             
-            # Generate public URL
-            public_url = f"{BASE_URL}/static/{filename}"
+            if self.s3_session:
+                await asyncio.to_thread(draft_path.unlink, missing_ok=True)
             
             # Store in session for future reference
-            session['published_url'] = public_url
-            session['carousel_id'] = carousel_id
-            
-            # Save to cache
-            await self.cache.save_carousel(
-                carousel_id=carousel_id,
-                user_id=user_id,
-                topic=session['topic'],
-                generated_content=session['generated_content'],
-                html_content=html_content,
-                public_url=public_url,
-                file_path=str(file_path)
-            )
+            session.published_url = public_url
+            session.draft_file_path = None
+            await self.sessions.set(user_id, session)
             
             success_text = (
                 "🎉 *Carousel has been published!*\n\n"
@@ -1771,36 +2529,20 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                 "💡 *Tip:* The link is permanent and will work without time restrictions."
             )
             
-            keyboard = [
-                [InlineKeyboardButton("🌐 Open Carousel", url=public_url)],
-                [InlineKeyboardButton("🎨 Create Another Carousel", callback_data="create_carousel")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = InlineKeyboardMarkup(((InlineKeyboardButton("🌐 Open Carousel", url=public_url),), *_PUBLISHED_ROWS))
             
             await query.edit_message_text(success_text, reply_markup=reply_markup, parse_mode='Markdown')
             
         except Exception as e:
-            logger.error(f"Error publishing carousel: {e}")
+            logger.error("Error publishing carousel: %s", e)
             await query.edit_message_text("❌ An error occurred during publishing. Please try again.")
             
     async def back_to_main_menu(self, query, user_id: int):
         """Return to main menu"""
-        user_sessions[user_id] = {'state': 'main_menu'}
-        
-        keyboard = [
-            [InlineKeyboardButton("🎨 Create New Carousel", callback_data="create_carousel")],
-            [InlineKeyboardButton("📚 My History", callback_data="show_history")],
-            [InlineKeyboardButton("ℹ️ How It Works", callback_data="how_it_works")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        welcome_text = (
-            "🎯 *Instagram Carousel Generator*\n\n"
-            "Choose an option:"
-        )
+        # Discards an unpublished draft
+        await self._replace_session(user_id, Session(state='main_menu'))
         
-        await query.edit_message_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+        await query.edit_message_text(_MENU_TEXT, reply_markup=_RETURN_MENU_MARKUP, parse_mode='Markdown')
     
     async def show_user_history(self, query, user_id: int):
         """Show user's carousel history"""
@@ -1813,34 +2555,29 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                     "You haven't created any carousels yet.\n\n"
                     "Create your first carousel to see it here!"
                 )
-                keyboard = [[InlineKeyboardButton("🎨 Create New Carousel", callback_data="create_carousel")],
-                           [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
             else:
-                text = "📚 *Your Recent Carousels:*\n\n"
+                parts = ["📚 *Your Recent Carousels:*\n\n"]
                 
                 for i, carousel in enumerate(carousels, 1):
                     created_date = carousel['created_at'][:10]  # Just the date part
-                    topic = carousel['topic'][:50] + "..." if len(carousel['topic']) > 50 else carousel['topic']
+                    topic = _md_bold(_truncate(carousel['topic'], 50))
                     
                     if carousel['public_url']:
-                        text += f"{i}. *{topic}*\n   📅 {created_date}\n   🔗 [View Carousel]({carousel['public_url']})\n\n"
+                        parts.append(f"{i}. {topic}\n   📅 {created_date}\n   🔗 [View Carousel]({carousel['public_url']})\n\n")
                     else:
-                        text += f"{i}. *{topic}*\n   📅 {created_date}\n   ⚠️ Not published\n\n"
+                        parts.append(f"{i}. {topic}\n   📅 {created_date}\n   ⚠️ Not published\n\n")
                 
-                keyboard = [[InlineKeyboardButton("🎨 Create New Carousel", callback_data="create_carousel")],
-                           [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
+                text = "".join(parts)
             
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+            await query.edit_message_text(text, reply_markup=_HISTORY_MARKUP, parse_mode='Markdown')
             
         except Exception as e:
-            logger.error(f"Error showing user history: {e}")
+            logger.error("Error showing user history: %s", e, exc_info=True)
             await query.edit_message_text("❌ An error occurred while loading your history. Please try again.")
     
     async def show_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /history command"""
         user_id = update.effective_user.id
-        await self.cache.init_db()
         
         try:
             carousels = await self.cache.get_user_carousels(user_id, limit=10)
@@ -1852,80 +2589,130 @@ WAŻNE: Odpowiedz TYLKO w formacie JSON. Nie dodawaj żadnych dodatkowych tekst
                     "Use /start to create your first carousel!"
                 )
             else:
-                text = "📚 *Your Carousel History:*\n\n"
+                parts = ["📚 *Your Carousel History:*\n\n"]
                 
                 for i, carousel in enumerate(carousels, 1):
                     created_date = carousel['created_at'][:10]
-                    topic = carousel['topic'][:40] + "..." if len(carousel['topic']) > 40 else carousel['topic']
+                    topic = _truncate(carousel['topic'], 40).translate(_MD_ESCAPE)
                     
                     if carousel['public_url']:
-                        text += f"{i}. {topic}\n   📅 {created_date} - [View]({carousel['public_url']})\n\n"
+                        parts.append(f"{i}. {topic}\n   📅 {created_date} - [View]({carousel['public_url']})\n\n")
                     else:
-                        text += f"{i}. {topic}\n   📅 {created_date} - Not published\n\n"
+                        parts.append(f"{i}. {topic}\n   📅 {created_date} - Not published\n\n")
+                
+                text = "".join(parts)
             
             await update.message.reply_text(text, parse_mode='Markdown')
             
         except Exception as e:
-            logger.error(f"Error in show_history: {e}")
-            await update.message.reply_text("❌ An error occurred while loading your history.")
+            logger.error("Error in show_history: %s", e, exc_info=True)
+            self._queue_status(update.effective_chat.id, "❌ An error occurred while loading your history.")
     
     async def show_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /stats command - show overall statistics"""
-        await self.cache.init_db()
-        
         try:
-            stats = await self.cache.get_carousel_stats()
+            # Repeated /stats calls reuse the rendered reply until the stats behind it are STATS_CACHE_TTL old
+            if self._stats_text and time.time() < self._stats_text[0]:
+                await update.message.reply_text(self._stats_text[1], parse_mode='Markdown')
+                return
+            
+            stats, fetched_at = await self._get_carousel_stats()
             
-            text = "📊 *Carousel Generator Statistics:*\n\n"
-            text += f"🎨 Total Carousels: {stats.get('total_carousels', 0)}\n"
-            text += f"👥 Unique Users: {stats.get('unique_users', 0)}\n"
-            text += f"🔥 Created Today: {stats.get('recent_carousels', 0)}\n\n"
+            parts = [_STATS_TEMPLATE.format_map({**_STATS_DEFAULTS, **stats})]
             
             if stats.get('popular_topics'):
-                text += "*Popular Topics:*\n"
-                for topic, count in stats['popular_topics']:
-                    topic_short = topic[:30] + "..." if len(topic) > 30 else topic
-                    text += f"• {topic_short} ({count})\n"
+                parts.append(_POPULAR_TOPICS_HEADER)
+                length = len(parts[0]) + len(_POPULAR_TOPICS_HEADER)
+                
+                for topic, count in itertools.islice(stats['popular_topics'], _STATS_MAX_TOPICS):
+                    line = f"• {topic.translate(_MD_ESCAPE)} ({count})\n"
+                    length += len(line)
+                    if length > _STATS_MAX_LENGTH:
+                        break
+                    parts.append(line)
+            
+            text = "".join(parts)
+            
+            if stats:
+                self._stats_text = (fetched_at + STATS_CACHE_TTL, text)
             
             await update.message.reply_text(text, parse_mode='Markdown')
             
         except Exception as e:
-            logger.error(f"Error in show_stats: {e}")
-            await update.message.reply_text("❌ An error occurred while loading statistics.")
-        
-    def run(self):
-        """Run the bot and web server"""
+            logger.error("Error in show_stats: %s", e, exc_info=True)
+            self._queue_status(update.effective_chat.id, "❌ An error occurred while loading statistics.")
+        
+    async def close_clients(self):
+        """Stop the background workers and close the shared API connection pools"""
+        if self._outbox_task:
+            self._outbox_task.cancel()
+        if self._image_writer_task:
+            self._image_writer_task.cancel()
+        if self._draft_sweep_task:
+            self._draft_sweep_task.cancel()
+        
+        # Includes the shared OpenAI client, which the pool uses for the primary key
+        await self.model_pool.close()
+        
+        if openrouter_client:
+            await openrouter_client.aclose()
+        await download_client.aclose()
+        await self._s3_stack.aclose()
+        
+        if self.redis is not None:
+            await self.redis.aclose()
+    
+    async def run_async(self):
+        """Run the bot and web server until the server is shut down"""
         logger.info("Starting Carousel Bot...")
         
-        # Start FastAPI server in a separate thread
-        def start_web_server():
-            port = int(os.getenv('PORT', 8000))
-            logger.info(f"Starting web server on port {port}")
-            uvicorn.run(web_app, host="0.0.0.0", port=port, log_level="info")
-        
-        # Start web server in background thread
-        web_thread = threading.Thread(target=start_web_server, daemon=True)
-        web_thread.start()
-        
-        # Start Telegram bot
+        # Start Telegram bot on the current event loop so the API clients keep their pools
         logger.info("Starting Telegram bot...")
-        self.app.run_polling()
+        async with self.app:
+            # post_init only runs under run_polling()/run_webhook(), so call the hook directly
+            await self.on_startup(self.app)
+            await self.app.start()
+            await self.start_updates()
+            
+            # Serve the FastAPI app on the same event loop instead of a second thread
+            port = int(os.getenv('PORT', 8000))
+            logger.info("Starting web server on port %s", port)
+            web_app.add_api_route(WEBHOOK_PATH, self.handle_webhook, methods=["POST"])
+            web_server = uvicorn.Server(uvicorn.Config(web_app, host="0.0.0.0", port=port, log_level="info"))
+            
+            try:
+                # uvicorn turns SIGINT/SIGTERM into a graceful exit, after which the bot is stopped too
+                await web_server.serve()
+            finally:
+                await self.stop_updates()
+                await self.app.stop()
+                await self.close_clients()
 
 if __name__ == "__main__":
-    if not TELEGRAM_TOKEN:
-        logger.error("Missing required environment variable: TELEGRAM_BOT_TOKEN")
+    required = {"TELEGRAM_BOT_TOKEN": CFG.telegram_token}
+    if missing := [name for name, value in required.items() if not value]:
+        logger.error("Missing required environment variables: %s", ", ".join(missing))
         exit(1)
-        
-    if not ANTHROPIC_API_KEY and not OPENAI_API_KEY:
+    
+    # Text generation providers in fallback order, plus OpenRouter for images
+    providers = [name for name, configured in (
+        ("Claude", _api_keys('ANTHROPIC_API_KEY')),
+        ("OpenAI GPT-5", _api_keys('OPENAI_API_KEY')),
+    ) if configured]
+    if not providers:
         logger.error("Missing AI API keys: Please provide either ANTHROPIC_API_KEY or OPENAI_API_KEY")
         exit(1)
-        
-    if ANTHROPIC_API_KEY:
-        logger.info("Claude API key found - will use as primary")
-    if OPENAI_API_KEY:
-        logger.info("OpenAI GPT-5 API key found - will use as fallback" if ANTHROPIC_API_KEY else "OpenAI GPT-5 API key found - will use as primary")
-    if OPEN_ROUTER_API_KEY:
-        logger.info("OpenRouter API key found - will use for image generation with Gemini 2.5 Flash")
-        
+    
+    if CFG.open_router_key:
+        providers.append("OpenRouter Gemini 2.5 Flash (images)")
+    logger.info("AI providers enabled: %s", ", ".join(providers))
+    
+    # Run the bot on uvloop instead of the default selector event loop where it is available
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        logger.info("uvloop not installed, using the default asyncio event loop")
+    
     bot = CarouselBot()
-    bot.run()
+    asyncio.run(bot.run_async())
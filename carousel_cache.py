@@ -1,20 +1,46 @@
 import sqlite3
-import json
+import orjson
 import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, List, Dict
 import aiosqlite
 
+# Per-connection settings: WAL-friendly fsync behaviour, in-memory temp tables and a 128 MB mmap
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",
+)
+
+_SAVE_CAROUSEL_SQL = """
+    INSERT OR REPLACE INTO carousels 
+    (carousel_id, user_id, topic, generated_content, html_content, 
+     public_url, file_path, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+"""
+
 class CarouselCache:
     """SQLite-based cache for storing carousel data"""
     
     def __init__(self, db_path: str = "carousels.db"):
         self.db_path = db_path
+    
+    @asynccontextmanager
+    async def _connect(self):
+        """Open a connection with the performance pragmas applied"""
+        async with aiosqlite.connect(self.db_path) as db:
+            for pragma in _CONNECTION_PRAGMAS:
+                await db.execute(pragma)
+            yield db
         
     async def init_db(self):
         """Initialize the database with required tables"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
+            # WAL is stored in the database file, so setting it once covers every later connection
+            await db.execute("PRAGMA journal_mode=WAL")
+            
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS carousels (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -50,14 +76,9 @@ class CarouselCache:
                           public_url: str = None, file_path: str = None) -> bool:
         """Save a carousel to the cache"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("""
-                    INSERT OR REPLACE INTO carousels 
-                    (carousel_id, user_id, topic, generated_content, html_content, 
-                     public_url, file_path, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                """, (carousel_id, user_id, topic, generated_content, html_content, 
-                      public_url, file_path))
+            async with self._connect() as db:
+                await db.execute(_SAVE_CAROUSEL_SQL, (carousel_id, user_id, topic, generated_content,
+                                                      html_content, public_url, file_path))
                 await db.commit()
                 return True
         except Exception as e:
@@ -67,7 +88,7 @@ class CarouselCache:
     async def get_carousel(self, carousel_id: str) -> Optional[Dict]:
         """Get a carousel by ID"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 async with db.execute("""
                     SELECT * FROM carousels WHERE carousel_id = ?
                 """, (carousel_id,)) as cursor:
@@ -83,7 +104,7 @@ class CarouselCache:
     async def get_user_carousels(self, user_id: int, limit: int = 10) -> List[Dict]:
         """Get recent carousels for a user"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 async with db.execute("""
                     SELECT carousel_id, topic, public_url, created_at 
                     FROM carousels 
@@ -101,7 +122,7 @@ class CarouselCache:
     async def update_carousel_url(self, carousel_id: str, public_url: str, file_path: str) -> bool:
         """Update carousel with published URL and file path"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 await db.execute("""
                     UPDATE carousels 
                     SET public_url = ?, file_path = ?, updated_at = CURRENT_TIMESTAMP
@@ -113,11 +134,22 @@ class CarouselCache:
             print(f"Error updating carousel URL: {e}")
             return False
     
+    async def delete_carousel(self, carousel_id: str) -> bool:
+        """Delete a carousel by ID"""
+        try:
+            async with self._connect() as db:
+                await db.execute("DELETE FROM carousels WHERE carousel_id = ?", (carousel_id,))
+                await db.commit()
+                return True
+        except Exception as e:
+            print(f"Error deleting carousel: {e}")
+            return False
+    
     async def save_user_session(self, user_id: int, session_data: Dict) -> bool:
         """Save user session data"""
         try:
-            session_json = json.dumps(session_data)
-            async with aiosqlite.connect(self.db_path) as db:
+            session_json = orjson.dumps(session_data).decode()
+            async with self._connect() as db:
                 await db.execute("""
                     INSERT OR REPLACE INTO user_sessions 
                     (user_id, session_data, last_activity)
@@ -132,13 +164,13 @@ class CarouselCache:
     async def get_user_session(self, user_id: int) -> Optional[Dict]:
         """Get user session data"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 async with db.execute("""
                     SELECT session_data FROM user_sessions WHERE user_id = ?
                 """, (user_id,)) as cursor:
                     row = await cursor.fetchone()
                     if row and row[0]:
-                        return json.loads(row[0])
+                        return orjson.loads(row[0])
                     return None
         except Exception as e:
             print(f"Error getting user session: {e}")
@@ -147,7 +179,7 @@ class CarouselCache:
     async def get_carousel_stats(self) -> Dict:
         """Get overall carousel statistics"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 # Total carousels
                 async with db.execute("SELECT COUNT(*) FROM carousels") as cursor:
                     total_carousels = (await cursor.fetchone())[0]
@@ -163,9 +195,10 @@ class CarouselCache:
                 """) as cursor:
                     recent_carousels = (await cursor.fetchone())[0]
                 
-                # Most popular topics
+                # Most popular topics, shortened for display by SQLite
                 async with db.execute("""
-                    SELECT topic, COUNT(*) as count 
+                    SELECT SUBSTR(topic, 1, 30) || CASE WHEN LENGTH(topic) > 30 THEN '...' ELSE '' END,
+                           COUNT(*) as count 
                     FROM carousels 
                     GROUP BY LOWER(topic) 
                     ORDER BY count DESC 
@@ -186,7 +219,7 @@ class CarouselCache:
     async def cleanup_old_sessions(self, days: int = 7) -> int:
         """Clean up old user sessions"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 cursor = await db.execute("""
                     DELETE FROM user_sessions 
                     WHERE last_activity < datetime('now', '-{} days')
@@ -201,7 +234,7 @@ class CarouselCache:
     async def search_carousels(self, query: str, user_id: int = None, limit: int = 10) -> List[Dict]:
         """Search carousels by topic or content"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._connect() as db:
                 if user_id:
                     sql = """
                         SELECT carousel_id, topic, public_url, created_at 
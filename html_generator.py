@@ -1,7 +1,7 @@
+import asyncio
 import re
 from pathlib import Path
 from typing import List, Dict
-import aiofiles
 
 class HTMLCarouselGenerator:
     """Generate HTML carousels from content"""
@@ -14,11 +14,8 @@ class HTMLCarouselGenerator:
     async def generate_html(self, content: str) -> str:
         """Generate HTML carousel from content"""
         # Read the HTML template and cards template
-        async with aiofiles.open(self.template_path, 'r', encoding='utf-8') as f:
-            html_template = await f.read()
-        
-        async with aiofiles.open(self.cards_template_path, 'r', encoding='utf-8') as f:
-            cards_template = await f.read()
+        html_template = await asyncio.to_thread(self.template_path.read_text, encoding='utf-8')
+        cards_template = await asyncio.to_thread(self.cards_template_path.read_text, encoding='utf-8')
         
         # Parse content into cards
         cards = self.parse_content_to_cards(content)
@@ -1,7 +1,16 @@
-import json
+import asyncio
 from pathlib import Path
-from typing import List, Dict
-import aiofiles
+from typing import List, Dict, Union
+import orjson
+
+# Template files are static, so each is read once per process and shared by every generator
+_template_cache: Dict[Path, str] = {}
+
+async def read_template(path: Path) -> str:
+    """Return a template's contents, reading the file only on first use"""
+    if path not in _template_cache:
+        _template_cache[path] = await asyncio.to_thread(path.read_text, encoding='utf-8')
+    return _template_cache[path]
 
 class JSONCarouselGenerator:
     """Generate HTML carousels from JSON card data"""
@@ -11,21 +20,18 @@ class JSONCarouselGenerator:
         self.template_path = Path(template_path)
         self.cards_template_path = Path(cards_template_path)
     
-    async def generate_html_from_json(self, cards_json: str) -> str:
-        """Generate HTML carousel from JSON cards"""
+    async def generate_html_from_json(self, cards_json: Union[str, Dict]) -> str:
+        """Generate HTML carousel from JSON cards (raw or already parsed)"""
         # Parse JSON
         try:
-            cards_data = json.loads(cards_json)
+            cards_data = orjson.loads(cards_json) if isinstance(cards_json, str) else cards_json
             cards = cards_data.get('cards', [])
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON format: {e}")
         
         # Read templates
-        async with aiofiles.open(self.template_path, 'r', encoding='utf-8') as f:
-            html_template = await f.read()
-        
-        async with aiofiles.open(self.cards_template_path, 'r', encoding='utf-8') as f:
-            cards_template = await f.read()
+        html_template = await read_template(self.template_path)
+        cards_template = await read_template(self.cards_template_path)
         
         # Generate HTML
         html_content = await self.replace_template_content(html_template, cards, cards_template)
@@ -193,10 +199,10 @@ class JSONCarouselGenerator:
         
         return filled_template
     
-    def format_cards_for_display(self, cards_json: str) -> str:
-        """Format JSON cards for user display/editing"""
+    def format_cards_for_display(self, cards_json: Union[str, Dict]) -> str:
+        """Format JSON cards (raw or already parsed) for user display/editing"""
         try:
-            cards_data = json.loads(cards_json)
+            cards_data = orjson.loads(cards_json) if isinstance(cards_json, str) else cards_json
             cards = cards_data.get('cards', [])
             
             formatted_text = "📋 **Generated Carousel Cards:**\n\n"
@@ -213,5 +219,5 @@ class JSONCarouselGenerator:
             
             return formatted_text
             
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return "❌ Invalid JSON format"
@@ -1,8 +1,9 @@
-import json
 import re
 from pathlib import Path
-from typing import List, Dict
-import aiofiles
+from typing import List, Dict, Union
+import orjson
+
+from json_html_generator import read_template
 
 class JSONCarouselGeneratorStyle2:
     """Generate HTML carousels from JSON card data using Style 2 (grid layout)"""
@@ -12,21 +13,18 @@ class JSONCarouselGeneratorStyle2:
         self.template_path = Path(template_path)
         self.cards_template_path = Path(cards_template_path)
     
-    async def generate_html_from_json(self, cards_json: str) -> str:
-        """Generate HTML carousel from JSON cards"""
+    async def generate_html_from_json(self, cards_json: Union[str, Dict]) -> str:
+        """Generate HTML carousel from JSON cards (raw or already parsed)"""
         # Parse JSON
         try:
-            cards_data = json.loads(cards_json)
+            cards_data = orjson.loads(cards_json) if isinstance(cards_json, str) else cards_json
             cards = cards_data.get('cards', [])
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON format: {e}")
         
         # Read templates
-        async with aiofiles.open(self.template_path, 'r', encoding='utf-8') as f:
-            html_template = await f.read()
-        
-        async with aiofiles.open(self.cards_template_path, 'r', encoding='utf-8') as f:
-            cards_template = await f.read()
+        html_template = await read_template(self.template_path)
+        cards_template = await read_template(self.cards_template_path)
         
         # Generate HTML
         html_content = await self.replace_template_content(html_template, cards, cards_template)
@@ -206,10 +204,10 @@ class JSONCarouselGeneratorStyle2:
         
         return '\n\n'.join(sections_html)
     
-    def format_cards_for_display(self, json_content: str) -> str:
-        """Format JSON cards into a readable string for Telegram display"""
+    def format_cards_for_display(self, json_content: Union[str, Dict]) -> str:
+        """Format JSON cards (raw or already parsed) into a readable string for Telegram display"""
         try:
-            cards_data = json.loads(json_content)
+            cards_data = orjson.loads(json_content) if isinstance(json_content, str) else json_content
             cards = cards_data.get('cards', [])
             
             display_text = []
@@ -221,7 +219,7 @@ class JSONCarouselGeneratorStyle2:
                 display_text.append(f"Text:\n{text}\n")
                 
             return "\n".join(display_text)
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return f"Invalid JSON content:\n{json_content}"
         except Exception as e:
             return f"Error formatting content: {e}\n{json_content}"
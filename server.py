@@ -1,14 +1,17 @@
 import asyncio
 import os
+import stat
 from pathlib import Path
+from typing import Optional
 
-from fastapi import FastAPI, HTTPException
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, FileResponse
 import uvicorn
 from dotenv import load_dotenv
 
-from bot import CarouselBot
+from bot import WEBHOOK_PATH, CarouselBot
 
 # Load environment variables
 load_dotenv()
@@ -20,8 +23,41 @@ app = FastAPI(title="Carousel Generator", description="Instagram Carousel Genera
 static_dir = Path("static")
 static_dir.mkdir(exist_ok=True)
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Published files are written once under unique names, so their stat results are reused briefly;
+# bounded, and expiring so a removed or rewritten file is picked up within a minute
+_stat_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+
+def _cached_stat(path: Path) -> Optional[os.stat_result]:
+    """Return the stat result for a regular file, or None if there is no such file"""
+    result = _stat_cache.get(path)
+    if result is None:
+        try:
+            result = path.stat()
+        except OSError:
+            return None
+        if not stat.S_ISREG(result.st_mode):
+            return None
+        _stat_cache[path] = result
+    return result
+
+def _accepted_encodings(header: str) -> set:
+    """Return the content codings an Accept-Encoding header allows; q=0 marks a coding as refused"""
+    accepted, refused = set(), set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        (accepted if q > 0 else refused).add(coding.strip().lower())
+    
+    if '*' in accepted:
+        accepted |= {"br", "gzip"} - refused
+    return accepted
 
 @app.get("/")
 async def root():
@@ -41,21 +77,38 @@ async def health_check():
     return {"status": "healthy"}
 
 @app.get("/static/{filename}")
-async def serve_carousel(filename: str):
-    """Serve carousel HTML files"""
+async def serve_carousel(filename: str, request: Request):
+    """Serve carousel HTML files, preferring the pre-compressed copies"""
     file_path = static_dir / filename
     
-    if not file_path.exists():
+    file_stat = _cached_stat(file_path)
+    if file_stat is None:
         raise HTTPException(status_code=404, detail="Carousel not found")
     
     if not filename.endswith('.html'):
-        raise HTTPException(status_code=400, detail="Invalid file type")
+        # Generated images and other assets are served as-is
+        return FileResponse(file_path, stat_result=file_stat)
     
-    return FileResponse(
-        file_path,
-        media_type="text/html",
-        headers={"Cache-Control": "public, max-age=3600"}
-    )
+    headers = {"Cache-Control": "public, max-age=3600", "Vary": "Accept-Encoding"}
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if encoding not in accepted:
+            continue
+        encoded_path = file_path.with_name(filename + suffix)
+        encoded_stat = _cached_stat(encoded_path)
+        if encoded_stat is not None:
+            return FileResponse(
+                encoded_path,
+                media_type="text/html",
+                headers={**headers, "Content-Encoding": encoding},
+                stat_result=encoded_stat
+            )
+    
+    return FileResponse(file_path, media_type="text/html", headers=headers, stat_result=file_stat)
+
+# Mount static files (registered after the route above so it takes precedence)
+app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Global bot instance
 bot_instance = None
@@ -67,8 +120,9 @@ async def start_bot():
         bot_instance = CarouselBot()
         # Start bot in background
         await bot_instance.app.initialize()
+        await bot_instance.on_startup(bot_instance.app)
         await bot_instance.app.start()
-        await bot_instance.app.updater.start_polling()
+        await bot_instance.start_updates()
         print("✅ Telegram bot started successfully")
     except Exception as e:
         print(f"❌ Error starting bot: {e}")
@@ -78,13 +132,21 @@ async def stop_bot():
     global bot_instance
     if bot_instance:
         try:
-            await bot_instance.app.updater.stop()
+            await bot_instance.stop_updates()
             await bot_instance.app.stop()
             await bot_instance.app.shutdown()
+            await bot_instance.close_clients()
             print("✅ Telegram bot stopped successfully")
         except Exception as e:
             print(f"❌ Error stopping bot: {e}")
 
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    """Hand updates posted by Telegram to the bot"""
+    if bot_instance is None:
+        raise HTTPException(status_code=503, detail="Bot is starting")
+    return await bot_instance.handle_webhook(request)
+
 @app.on_event("startup")
 async def startup_event():
     """Start the bot when the server starts"""
@@ -0,0 +1,64 @@
+from dataclasses import dataclass, field, fields, replace
+from typing import Dict, Optional
+
+import orjson
+import redis.asyncio
+from cachetools import TTLCache
+
+@dataclass(slots=True)
+class Session:
+    """Conversation state for one user"""
+    state: str = 'main_menu'
+    step: str = ''
+    style: str = 'style_1'
+    topic: str = ''
+    generated_content: str = ''
+    # Decoded cards kept alongside generated_content for in-process reuse; not written to Redis
+    parsed_content: Optional[Dict] = field(default=None, metadata={'persist': False})
+    suggested_images: Optional[str] = None
+    slide_image_url: Optional[str] = None
+    original_image_url: Optional[str] = None
+    slide_image_description: Optional[str] = None
+    carousel_id: Optional[str] = None
+    draft_file_path: Optional[str] = None
+    published_url: Optional[str] = None
+
+_SESSION_FIELDS = frozenset(f.name for f in fields(Session))
+# Cleared before a session is serialised so derived data doesn't double the stored payload
+_TRANSIENT_FIELDS = dict.fromkeys(f.name for f in fields(Session) if not f.metadata.get('persist', True))
+
+class RedisSessionStore:
+    """Per-user conversation state stored in Redis with an expiry"""
+
+    def __init__(self, client: Optional[redis.asyncio.Redis], ttl: int, prefix: str = "sess:",
+                 local_maxsize: int = 10_000):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        # Fallback used when Redis is not configured (local development); bounded and expiring like Redis
+        self._local: TTLCache = TTLCache(maxsize=local_maxsize, ttl=ttl)
+
+    async def get(self, user_id: int) -> Optional[Session]:
+        """Load the user's session, or None if it doesn't exist or has expired"""
+        if self.client is None:
+            return self._local.get(user_id)
+
+        data = await self.client.get(f"{self.prefix}{user_id}")
+        if not data:
+            return None
+        # Ignore keys written by older versions of the bot
+        return Session(**{key: value for key, value in orjson.loads(data).items() if key in _SESSION_FIELDS})
+
+    async def set(self, user_id: int, session: Session, ex: Optional[int] = None):
+        """Store the user's session, refreshing its expiry"""
+        if self.client is None:
+            self._local[user_id] = session
+            return
+
+        await self.client.set(f"{self.prefix}{user_id}", orjson.dumps(replace(session, **_TRANSIENT_FIELDS)), ex=ex or self.ttl)
+
+    async def update(self, user_id: int, **changes) -> Session:
+        """Change fields of the user's session and return the result"""
+        session = replace(await self.get(user_id) or Session(), **changes)
+        await self.set(user_id, session)
+        return session
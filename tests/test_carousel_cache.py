@@ -0,0 +1,41 @@
+import asyncio
+
+from carousel_cache import CarouselCache
+
+
+def test_round_trip_through_a_real_database(tmp_path):
+    """Creating the schema, saving and reading back a carousel all go through _connect"""
+    cache = CarouselCache(str(tmp_path / "carousels.db"))
+
+    async def scenario():
+        await cache.init_db()
+        assert await cache.save_carousel("c1", 42, "Growth mindset", "{}", "<html></html>")
+        assert await cache.update_carousel_url("c1", "https://example.com/c1", "published/c1.html")
+
+        carousel = await cache.get_carousel("c1")
+        assert carousel["topic"] == "Growth mindset"
+        assert carousel["public_url"] == "https://example.com/c1"
+
+        history = await cache.get_user_carousels(42)
+        assert [row["carousel_id"] for row in history] == ["c1"]
+
+        stats = await cache.get_carousel_stats()
+        assert stats["total_carousels"] == 1
+        assert stats["unique_users"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_connections_apply_the_pragmas(tmp_path):
+    """Each connection runs with WAL journaling and relaxed fsync"""
+    cache = CarouselCache(str(tmp_path / "carousels.db"))
+
+    async def scenario():
+        await cache.init_db()
+        async with cache._connect() as db:
+            async with db.execute("PRAGMA journal_mode") as cursor:
+                assert (await cursor.fetchone())[0] == "wal"
+            async with db.execute("PRAGMA synchronous") as cursor:
+                assert (await cursor.fetchone())[0] == 1  # NORMAL
+
+    asyncio.run(scenario())
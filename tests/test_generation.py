@@ -0,0 +1,201 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import bot
+from bot import CarouselBot, _CircuitBreaker, _PoolMember
+
+
+@pytest.fixture
+def carousel_bot():
+    # The helpers under test need no Telegram application, so skip __init__
+    return CarouselBot.__new__(CarouselBot)
+
+
+# fix_truncated_json
+
+def test_closes_nested_objects_and_arrays_in_order(carousel_bot):
+    fixed = carousel_bot.fix_truncated_json('{"cards": [{"type": "main", "tags": ["a", "b"')
+    assert json.loads(fixed) == {"cards": [{"type": "main", "tags": ["a", "b"]}]}
+
+
+def test_escaped_quote_does_not_end_the_string(carousel_bot):
+    fixed = carousel_bot.fix_truncated_json('{"cards": [{"text": "she said \\"hi\\" and {left')
+    assert json.loads(fixed) == {"cards": [{"text": 'she said "hi" and {left'}]}
+
+
+def test_brackets_inside_strings_are_ignored(carousel_bot):
+    fixed = carousel_bot.fix_truncated_json('{"a": "[}{]", "b": [1, 2')
+    assert json.loads(fixed) == {"a": "[}{]", "b": [1, 2]}
+
+
+def test_dangling_backslash_is_dropped(carousel_bot):
+    fixed = carousel_bot.fix_truncated_json('{"text": "line one\\')
+    assert json.loads(fixed) == {"text": "line one"}
+
+
+def test_escaped_backslash_before_cut_is_kept(carousel_bot):
+    fixed = carousel_bot.fix_truncated_json('{"path": "C:\\\\')
+    assert json.loads(fixed) == {"path": "C:\\"}
+
+
+def test_complete_json_is_unchanged(carousel_bot):
+    assert carousel_bot.fix_truncated_json('{"cards": []}') == '{"cards": []}'
+
+
+# _CircuitBreaker
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_threshold_failures(clock):
+    breaker = _CircuitBreaker("test", threshold=3, recovery=60.0)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_allows_a_single_probe_then_closes(clock):
+    breaker = _CircuitBreaker("test", threshold=1, recovery=60.0)
+    breaker.record_failure()
+
+    clock[0] += 61
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # A second caller must wait while the probe is in flight
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.fail_count == 0
+    assert breaker.allow()
+
+
+def test_breaker_failed_probe_reopens(clock):
+    breaker = _CircuitBreaker("test", threshold=5, recovery=60.0)
+    for _ in range(5):
+        breaker.record_failure()
+
+    clock[0] += 61
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_replaces_a_stale_probe(clock):
+    breaker = _CircuitBreaker("test", threshold=1, recovery=60.0)
+    breaker.record_failure()
+    clock[0] += 61
+    assert breaker.allow()
+
+    clock[0] += 61
+    assert breaker.allow()
+
+
+# _generate_with_fallback
+
+def _member(name: str, provider: str) -> _PoolMember:
+    return _PoolMember(name, provider, None, _CircuitBreaker(name))
+
+
+def _bot_with(members, outcomes):
+    """Bot whose pool yields members and whose provider calls run outcomes[name](on_progress)"""
+    carousel_bot = CarouselBot.__new__(CarouselBot)
+    carousel_bot.model_pool = SimpleNamespace(candidates=lambda: iter(members))
+    calls = []
+
+    async def generate(member, prompt, on_progress, max_tokens, json_mode=True):
+        calls.append(member.name)
+        return await outcomes[member.name](on_progress)
+
+    carousel_bot._generate_with_member = generate
+    return carousel_bot, calls
+
+
+@pytest.fixture(autouse=True)
+def short_hedge_delay(monkeypatch):
+    monkeypatch.setattr(bot, "AI_HEDGE_DELAY", 0.05)
+
+
+def test_streaming_attempt_is_not_hedged():
+    async def streaming(on_progress):
+        await on_progress(10)
+        await asyncio.sleep(0.3)
+        return "claude"
+
+    async def unexpected(on_progress):
+        raise AssertionError("should not be called")
+
+    members = [_member("Claude #1", "claude"), _member("OpenAI #1", "openai")]
+    carousel_bot, calls = _bot_with(members, {"Claude #1": streaming, "OpenAI #1": unexpected})
+
+    result = asyncio.run(carousel_bot._generate_with_fallback("prompt", None, 100))
+
+    assert result == "claude"
+    assert calls == ["Claude #1"]
+
+
+def test_silent_attempt_is_hedged_and_the_loser_cancelled():
+    cancelled = []
+
+    async def silent(on_progress):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "claude"
+
+    async def fast(on_progress):
+        return "openai"
+
+    members = [_member("Claude #1", "claude"), _member("OpenAI #1", "openai")]
+    carousel_bot, calls = _bot_with(members, {"Claude #1": silent, "OpenAI #1": fast})
+
+    async def scenario():
+        result = await carousel_bot._generate_with_fallback("prompt", None, 100)
+        await asyncio.sleep(0)  # let the cancellation land
+        return result
+
+    assert asyncio.run(scenario()) == "openai"
+    assert calls == ["Claude #1", "OpenAI #1"]
+    assert cancelled == [True]
+    # The losing attempt does not count against its circuit
+    assert members[0].breaker.fail_count == 0
+
+
+def _status_error(error_class, status: int) -> Exception:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return error_class("error", response=httpx.Response(status, request=request), body=None)
+
+
+@pytest.mark.parametrize("error, counted", [
+    (_status_error(openai.BadRequestError, 400), False),
+    (_status_error(openai.RateLimitError, 429), True),
+    (_status_error(openai.InternalServerError, 503), True),
+    (TimeoutError(), True),
+])
+def test_only_transient_failures_count_against_the_circuit(error, counted):
+    async def failing(on_progress):
+        raise error
+
+    async def ok(on_progress):
+        return "openai"
+
+    members = [_member("OpenAI #1", "openai"), _member("OpenAI #2", "openai")]
+    carousel_bot, _ = _bot_with(members, {"OpenAI #1": failing, "OpenAI #2": ok})
+
+    assert asyncio.run(carousel_bot._generate_with_fallback("prompt", None, 100)) == "openai"
+    assert members[0].breaker.fail_count == (1 if counted else 0)
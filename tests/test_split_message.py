@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+from bot import CarouselBot
+
+
+@pytest.fixture
+def bot():
+    # split_message needs no Telegram application, so skip __init__
+    return CarouselBot.__new__(CarouselBot)
+
+
+def test_short_text_is_a_single_chunk(bot):
+    assert bot.split_message("hello", 100) == ["hello"]
+
+
+def test_long_line_after_a_short_line_is_cut(bot):
+    chunks = bot.split_message("a" * 50 + "\n" + "y" * 250, 100)
+    assert [len(chunk) for chunk in chunks] == [50, 100, 100, 50]
+
+
+def test_paragraphs_are_kept_whole_when_they_fit(bot):
+    cards = ["card one\ntext", "card two\ntext", "card three\ntext"]
+    assert bot.split_message("\n\n".join(cards), 30) == ["card one\ntext\n\ncard two\ntext", "card three\ntext"]
+
+
+def test_every_chunk_fits_and_no_text_is_lost(bot):
+    rng = random.Random(0)
+    for _ in range(500):
+        paragraphs = [
+            rng.choice(["\n", " "]).join("x" * rng.randint(0, 230) for _ in range(rng.randint(1, 4)))
+            for _ in range(rng.randint(1, 10))
+        ]
+        text = "\n\n".join(paragraphs)
+        max_length = rng.randint(20, 120)
+
+        chunks = bot.split_message(text, max_length)
+
+        assert all(0 < len(chunk) <= max_length for chunk in chunks)
+        assert "".join(chunks).replace("\n", "").replace(" ", "") == text.replace("\n", "").replace(" ", "")